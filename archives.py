@@ -0,0 +1,131 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.7z')
+# Защита от архивов-бомб: считаются реально распакованные байты, а не размеры из заголовков
+MAX_MEMBERS = 5000
+MAX_MEMBER_SIZE = 1024 * 1024 * 1024
+MAX_TOTAL_SIZE = 4 * 1024 * 1024 * 1024
+
+
+def is_archive(file_name: str) -> bool:
+    return file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _part_name(member_name: str) -> str:
+    # Каталоги внутри архива не важны - деталь определяется именем файла
+    return os.path.splitext(os.path.basename(member_name.rstrip('/')))[0]
+
+
+def extract_stl_members(source, file_name: str, wanted: set, workspace, store) -> tuple:
+    """
+    Достаёт из архива STL-файлы, имена которых есть в wanted, прямо в
+    рабочее пространство заказа. Архив не распаковывается на диск целиком:
+    члены ZIP читаются по одному потоком, маленькие - в память,
+    большие - во временную папку заказа (см. OrderWorkspace.destination).
+
+    Параметры:
+        source: содержимое архива (bytes) или путь к нему.
+        file_name: имя архива (по расширению выбирается формат).
+        wanted: имена деталей из заказа.
+        workspace: OrderWorkspace заказа.
+        store: store(имя детали, источник) вызывается сразу после распаковки
+               каждого файла и должен сохранить его (например, в stl_store):
+               источник - bytes или путь во временной папке, которая потом
+               удаляется. Так в памяти одновременно лежит не больше одного
+               распакованного файла.
+
+    Возвращает:
+        tuple: ([(имя детали, имя файла, результат store)], [пропущенные файлы])
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    if file_name.lower().endswith('.7z'):
+        return _extract_7z(source, wanted, workspace, store)
+    return _extract_zip(source, wanted, workspace, store)
+
+
+def _copy_limited(src, dst, limit: int) -> int:
+    """Копирует поток блоками, но не больше limit байт; возвращает число байт."""
+    copied = 0
+    for block in iter(lambda: src.read(1 << 20), b''):
+        copied += len(block)
+        if copied > limit:
+            raise ValueError("Архив распаковывается в слишком большой объём")
+        dst.write(block)
+    return copied
+
+
+def _extract_zip(source, wanted: set, workspace, store) -> tuple:
+    extracted, skipped = [], []
+    budget = MAX_TOTAL_SIZE
+    with zipfile.ZipFile(source) as archive:
+        members = [m for m in archive.infolist() if not m.is_dir()]
+        if len(members) > MAX_MEMBERS:
+            raise ValueError(f"В архиве больше {MAX_MEMBERS} файлов")
+
+        for member in members:
+            base_name = os.path.basename(member.filename)
+            part_name = _part_name(member.filename)
+            if not base_name.lower().endswith('.stl') or part_name not in wanted \
+                    or member.file_size > MAX_MEMBER_SIZE:
+                skipped.append(base_name)
+                continue
+
+            destination = workspace.destination(base_name, member.file_size)
+            limit = min(MAX_MEMBER_SIZE, budget)
+            with archive.open(member) as src:
+                if isinstance(destination, io.BytesIO):
+                    budget -= _copy_limited(src, destination, limit)
+                else:
+                    with open(destination, 'wb') as dst:
+                        budget -= _copy_limited(src, dst, limit)
+            extracted.append((part_name, base_name, store(part_name, workspace.source(destination))))
+    return extracted, skipped
+
+
+def _extract_7z(source, wanted: set, workspace, store) -> tuple:
+    # 7z - необязательная зависимость, импортируется только когда нужна
+    try:
+        import py7zr
+    except ImportError:
+        raise ValueError("Архивы 7z не поддерживаются: установите py7zr") from None
+
+    extracted, skipped = [], []
+    with py7zr.SevenZipFile(source, mode='r') as archive:
+        names = [name for name in archive.getnames() if not name.endswith('/')]
+        if len(names) > MAX_MEMBERS:
+            raise ValueError(f"В архиве больше {MAX_MEMBERS} файлов")
+
+        targets = []
+        for name in names:
+            if name.lower().endswith('.stl') and _part_name(name) in wanted:
+                targets.append(name)
+            else:
+                skipped.append(os.path.basename(name))
+
+        if targets:
+            # 7z распаковывается блоками (solid), поэтому выбранные файлы
+            # уходят во временную папку заказа одним проходом
+            tmp_dir = tempfile.mkdtemp(prefix=f"order_{workspace.order_id}_7z_")
+            try:
+                archive.extract(path=tmp_dir, targets=targets)
+                sizes = {name: os.path.getsize(os.path.join(tmp_dir, name)) for name in targets
+                         if os.path.isfile(os.path.join(tmp_dir, name))}
+                if sum(sizes.values()) > MAX_TOTAL_SIZE:
+                    raise ValueError("Архив распаковывается в слишком большой объём")
+                for name in targets:
+                    if sizes.get(name, MAX_MEMBER_SIZE + 1) > MAX_MEMBER_SIZE:
+                        skipped.append(os.path.basename(name))
+                        continue
+                    # Файл уже на диске - отдаём путь, store переносит его без чтения в память
+                    extracted.append((_part_name(name), os.path.basename(name),
+                                      store(_part_name(name), os.path.join(tmp_dir, name))))
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    return extracted, skipped
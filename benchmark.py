@@ -0,0 +1,302 @@
+"""
+Бенчмарки расчёта массы и генерации чеков.
+
+Генерирует синтетические STL (замкнутая сфера) нужного числа треугольников
+в бинарном и ASCII виде и замеряет:
+    - weight_from_stl.calculate_mass_from_stl
+    - Receipt.generate_table и Receipt.generate_report
+    - main.extract_filament_weight
+    - сквозной прогон обработчиков бота с подменённым Bot
+
+Каждый замер выполняется в отдельном процессе, чтобы пиковый RSS
+относился только к нему, и в пустой временной папке, чтобы кэши
+из data/ не влияли на результат. Результат - JSON.
+
+Пример:
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+FULL_SIZES = DEFAULT_SIZES + [10_000_000]
+ASCII_CHUNK_FACETS = 100_000
+
+
+# === Синтетические модели ===
+def sphere_triangles(triangles: int, radius: float = 20.0):
+    """Замкнутая UV-сфера примерно из triangles треугольников, массив (n, 3, 3)."""
+    rings = max(2, int(round((triangles / 4) ** 0.5)))
+    theta = np.linspace(0, np.pi, rings + 1)
+    phi = np.linspace(0, 2 * np.pi, 2 * rings + 1)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    points = np.stack([radius * np.sin(t) * np.cos(p),
+                       radius * np.sin(t) * np.sin(p),
+                       radius * np.cos(t)], axis=-1).astype(np.float32)
+    a, b = points[:-1, :-1], points[1:, :-1]
+    c, d = points[1:, 1:], points[:-1, 1:]
+    return np.concatenate([np.stack([a, b, c], 2).reshape(-1, 3, 3),
+                           np.stack([a, c, d], 2).reshape(-1, 3, 3)])
+
+
+def write_binary_stl(path: str, vectors) -> None:
+    import weight_from_stl
+
+    records = np.zeros(len(vectors), dtype=weight_from_stl.BINARY_STL_DTYPE)
+    records['v0'], records['v1'], records['v2'] = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    with open(path, 'wb') as f:
+        f.write(b'benchmark'.ljust(80, b' '))
+        f.write(np.uint32(len(vectors)).tobytes())
+        records.tofile(f)
+
+
+def write_ascii_stl(path: str, vectors) -> None:
+    facet = ("facet normal 0 0 0\n outer loop\n"
+             "  vertex %.6e %.6e %.6e\n  vertex %.6e %.6e %.6e\n  vertex %.6e %.6e %.6e\n"
+             " endloop\nendfacet\n")
+    with open(path, 'w') as f:
+        f.write("solid benchmark\n")
+        for start in range(0, len(vectors), ASCII_CHUNK_FACETS):
+            chunk = vectors[start:start + ASCII_CHUNK_FACETS]
+            f.write((facet * len(chunk)) % tuple(chunk.ravel().tolist()))
+        f.write("endsolid benchmark\n")
+
+
+def write_gcode(path: str, lines: int) -> None:
+    with open(path, 'w') as f:
+        f.write("; generated by PrusaSlicer\n")
+        for start in range(0, lines, 100_000):
+            f.write("G1 X10.000 Y10.000 E0.01000\n" * min(100_000, lines - start))
+        f.write("; filament used [mm] = 1234.56\n; filament used [g] = 3.72\n")
+
+
+# === Замеры (выполняются в дочернем процессе) ===
+def peak_rss_mb() -> float:
+    # VmHWM сбрасывается при exec, а ru_maxrss на Linux наследуется от родителя
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def bench_mass(path):
+    import weight_from_stl
+    return weight_from_stl.calculate_mass_from_stl(path, 1.3)
+
+
+def bench_generate_table(volumes):
+    import receipt_generator
+    receipt = receipt_generator.Receipt(io.BytesIO())
+    receipt.set_data("\n".join(f"{name} 2" for name in volumes), volumes)
+    receipt.generate_table()
+    return len(receipt.table_data)
+
+
+def bench_generate_report(volumes):
+    import receipt_generator
+    receipt = receipt_generator.Receipt(io.BytesIO())
+    receipt.set_data("\n".join(f"{name} 2" for name in volumes), volumes)
+    receipt.generate_report()
+    return receipt.final_sum
+
+
+def bench_gcode(path):
+    import main
+    return main.extract_filament_weight(path)
+
+
+def bench_bot_e2e(paths):
+    """Сквозной прогон: заказ -> загрузка файлов -> "Завершить загрузку"."""
+    from unittest.mock import AsyncMock, MagicMock
+
+    import bot
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    files = {f"part{i}.stl": path for i, path in enumerate(paths)}
+    sent = []
+
+    def fake_message(document=None):
+        message = MagicMock()
+        message.chat.id = message.from_user.id = 1
+        message.document = document
+
+        async def answer(*args, **kwargs):
+            sent.append(args)
+            # file_id отправленного чека бот кладёт в receipt_cache - нужна строка
+            return MagicMock(message_id=len(sent), document=MagicMock(file_id=f"file{len(sent)}"))
+        message.answer = message.answer_document = answer
+        return message
+
+    async def get_file(file_id, **kwargs):
+        return MagicMock(file_path=file_id, file_size=os.path.getsize(files[file_id]))
+
+    async def download_file(file_path, destination=None, **kwargs):
+        with open(files[file_path], 'rb') as f:
+            data = f.read()
+        if destination is None:
+            return io.BytesIO(data)
+        if isinstance(destination, (str, os.PathLike)):
+            with open(destination, 'wb') as f:
+                f.write(data)
+        else:
+            destination.write(data)
+        return destination
+
+    fake_bot = MagicMock()
+    fake_bot.get_file = get_file
+    fake_bot.download_file = download_file
+    for method in ('send_message', 'edit_message_text', 'delete_message', 'edit_message_reply_markup'):
+        setattr(fake_bot, method, AsyncMock(return_value=MagicMock(message_id=0)))
+    bot.bot = bot.status.bot = bot.downloads.bot = fake_bot
+
+    async def run():
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=1, user_id=1))
+        order = MagicMock(text="\n".join(f"part{i} 2" for i in range(len(files))))
+        order.chat.id = order.from_user.id = 1
+        order.answer = fake_message().answer
+        await bot.process_order(order, state)
+        for name in files:
+            document = MagicMock(file_name=name, file_id=name, file_unique_id=name,
+                                 file_size=os.path.getsize(files[name]))
+            await bot.handle_document(fake_message(document), state)
+        callback = MagicMock(message=fake_message(), answer=AsyncMock())
+        callback.from_user.id = 1
+        await bot.process_done_uploading(callback, state)
+
+    asyncio.run(run())
+    bot.report_executor.shutdown()
+    return len(sent)
+
+
+def _run_case(func, args, queue):
+    # Кэши и хранилища в data/ создаются в пустой временной папке: рабочие
+    # data/ не задеваются, а попадания в кэш от прошлых прогонов не искажают замер
+    with tempfile.TemporaryDirectory(prefix="stl_bench_case_") as cwd:
+        os.chdir(cwd)
+        try:
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            queue.put({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(), 'result': repr(result)})
+        except Exception as e:
+            queue.put({'error': repr(e), 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_case(name, func, *args, repeat=1, **params):
+    """Запускает замер repeat раз, каждый - в новом процессе."""
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_case, args=(func, args, queue))
+        process.start()
+        runs.append(queue.get())
+        process.join()
+
+    record = {'name': name, **params}
+    errors = [run['error'] for run in runs if 'error' in run]
+    if errors:
+        record['error'] = errors[0]
+    else:
+        times = sorted(run['seconds'] for run in runs)
+        record.update(seconds_min=times[0], seconds_median=times[len(times) // 2],
+                      peak_rss_mb=max(run['peak_rss_mb'] for run in runs), result=runs[0]['result'])
+    print(json.dumps(record, ensure_ascii=False), file=sys.stderr)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки расчёта массы и генерации чеков")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="числа треугольников")
+    parser.add_argument("--full", action="store_true", help="прогон до 10M треугольников")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--parts", type=int, nargs="+", default=[10, 100, 1000], help="строк в чеке")
+    parser.add_argument("--no-ascii", action="store_true", help="не генерировать ASCII STL")
+    parser.add_argument("--no-bot", action="store_true", help="пропустить сквозной прогон бота")
+    parser.add_argument("--output", default=None, help="JSON-файл (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    sizes = FULL_SIZES if args.full else args.sizes
+    results = []
+    with tempfile.TemporaryDirectory(prefix="stl_bench_") as tmp:
+        binary_paths = []
+        for size in sizes:
+            vectors = sphere_triangles(size)
+            binary_path = os.path.join(tmp, f"sphere_{size}.stl")
+            write_binary_stl(binary_path, vectors)
+            binary_paths.append(binary_path)
+            results.append(run_case("calculate_mass_from_stl", bench_mass, binary_path, repeat=args.repeat,
+                                    format="binary", triangles=len(vectors),
+                                    file_mb=os.path.getsize(binary_path) / 2 ** 20))
+            if not args.no_ascii:
+                ascii_path = os.path.join(tmp, f"sphere_{size}_ascii.stl")
+                write_ascii_stl(ascii_path, vectors)
+                results.append(run_case("calculate_mass_from_stl", bench_mass, ascii_path, repeat=args.repeat,
+                                        format="ascii", triangles=len(vectors),
+                                        file_mb=os.path.getsize(ascii_path) / 2 ** 20))
+                os.remove(ascii_path)
+
+        # Объёмы считаются заранее, чтобы замерять только построение чека
+        import weight_from_stl
+        volume = weight_from_stl.calculate_volume_from_stl(binary_paths[0])
+        for parts in args.parts:
+            volumes = {f"part{i}": volume for i in range(parts)}
+            results.append(run_case("Receipt.generate_table", bench_generate_table, volumes,
+                                    repeat=args.repeat, parts=parts))
+            results.append(run_case("Receipt.generate_report", bench_generate_report, volumes,
+                                    repeat=args.repeat, parts=parts))
+
+        for lines in (10_000, 1_000_000, 10_000_000):
+            gcode_path = os.path.join(tmp, f"part_{lines}.gcode")
+            write_gcode(gcode_path, lines)
+            results.append(run_case("main.extract_filament_weight", bench_gcode, gcode_path, repeat=args.repeat,
+                                    lines=lines, file_mb=os.path.getsize(gcode_path) / 2 ** 20))
+            os.remove(gcode_path)
+
+        if not args.no_bot:
+            results.append(run_case("bot_e2e", bench_bot_e2e, binary_paths[:3], repeat=1,
+                                    files=len(binary_paths[:3])))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    failed = [record['name'] for record in results if 'error' in record]
+    if failed:
+        print(f"Замеры с ошибкой: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,95 @@
 import asyncio
+import io
+import math
+import multiprocessing
 import os
-import re
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import CommandStart
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram import F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.markdown import code
 
-from receipt_generator import Receipt
+import receipt_cache
+from receipt_cache import receipt_key
+from order import Order, MATERIALS, DEFAULT_MATERIAL
+import stl_store
+import tasks
+from workspace import OrderWorkspace
+from status import StatusUpdater
+from archives import is_archive, extract_stl_members
+from storage import create_storage, transform_data
+from downloads import DownloadManager, FileTooLarge
+from metrics import metrics, run_profiled, start_http_server, log_periodically
+from scheduler import JobScheduler, QueueFull, JobCancelled
 import config
 
 
 # === Настройки ===
 BOT_TOKEN = config.BOT_TOKEN
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# Локальный сервер Bot API (например, http://localhost:8081): файлы до 2000 МБ
+# вместо 20 МБ и скачивание прямо с диска сервера. Бота нужно заранее
+# перевести на него методом logOut облачного API.
+LOCAL_BOT_API_URL = getattr(config, 'LOCAL_BOT_API_URL', None)
 
-receipt = Receipt()
+
+def make_bot() -> Bot:
+    if not LOCAL_BOT_API_URL:
+        return Bot(token=BOT_TOKEN)
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    session = AiohttpSession(api=TelegramAPIServer.from_base(LOCAL_BOT_API_URL, is_local=True))
+    return Bot(token=BOT_TOKEN, session=session)
+
+
+bot = make_bot()
+dp = Dispatcher(storage=create_storage())
+
+# Пул процессов для тяжёлой работы (расчёт мешей и сборка PDF),
+# чтобы не блокировать event loop бота. NumPy, reportlab и шрифт
+# загружаются только в воркерах (см. tasks.py)
+REPORT_WORKERS = getattr(config, 'REPORT_WORKERS', None) or os.cpu_count()
+
+
+def make_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=REPORT_WORKERS, initializer=tasks.warm_up)
+
+
+report_executor = make_executor()
+
+# Очередь тяжёлых задач перед пулом: сколько выполняется одновременно
+# и сколько чеков одного пользователя может ждать в очереди
+MAX_CONCURRENT_JOBS = getattr(config, 'MAX_CONCURRENT_JOBS', None) or REPORT_WORKERS
+MAX_QUEUED_ORDERS = getattr(config, 'MAX_QUEUED_ORDERS', 2)
+
+# Сколько ждать объёмы, которые считает другой процесс бота (режим webhook с несколькими воркерами)
+FOREIGN_MASS_WAIT_S = 30
+
+# Через сколько секунд без действий брошенный заказ выгружается из памяти
+# процесса (скачанные файлы, расчёты); None - никогда
+ORDER_IDLE_TTL_S = getattr(config, 'ORDER_IDLE_TTL_S', 6 * 3600)
+
+# Режим webhook: публичный адрес, локальный адрес сервера и число процессов
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', None)
+WEBHOOK_HOST = getattr(config, 'WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8080)
+WEBHOOK_WORKERS = getattr(config, 'WEBHOOK_WORKERS', 1)
+
+# Метрики: порт HTTP-эндпоинта /metrics, период лога и порог профилирования
+# медленных заказов (в секундах; None - выключено)
+METRICS_PORT = getattr(config, 'METRICS_PORT', None)
+METRICS_LOG_INTERVAL = getattr(config, 'METRICS_LOG_INTERVAL', None)
+PROFILE_SLOW_ORDERS_S = getattr(config, 'PROFILE_SLOW_ORDERS_S', None)
 
 
 # === FSM (состояния) ===
@@ -28,8 +97,201 @@ class OrderState(StatesGroup):
     waiting_for_order = State()
     waiting_for_files = State()
 
-# === Глобальное хранение задач обновления ===
-pending_updates = defaultdict(lambda: None)
+# === Статусные сообщения заказов (одно на заказ, редактируется на месте) ===
+status = StatusUpdater(bot)
+
+# === Фоновые расчёты объёмов: chat_id -> {имя детали: asyncio.Task} ===
+volume_tasks = defaultdict(dict)
+
+# === Скачивание файлов: ограничение параллельности, повторы, предел размера ===
+downloads = DownloadManager(bot)
+
+# === Очередь задач с честным обходом пользователей ===
+jobs = JobScheduler(MAX_CONCURRENT_JOBS, limits={'report': MAX_QUEUED_ORDERS})
+
+# === Чаты, для которых сейчас формируется чек ===
+reports_in_progress = set()
+
+# === Фоновые задачи процесса (держим ссылки, чтобы их не собрал GC) ===
+background_tasks = set()
+
+# === Скачанные файлы заказов: chat_id -> OrderWorkspace ===
+workspaces = {}
+
+# === Заказы в памяти процесса: chat_id -> Order (копия FSM-состояния) ===
+orders = {}
+
+# === Последнее действие по заказу: chat_id -> time.monotonic() ===
+order_activity = {}
+
+
+def get_workspace(chat_id, order_id) -> OrderWorkspace:
+    workspace = workspaces.get(chat_id)
+    if workspace is None or workspace.order_id != order_id:
+        if workspace is not None:
+            workspace.cleanup()
+        workspace = workspaces[chat_id] = OrderWorkspace(order_id)
+    return workspace
+
+
+def close_order(chat_id):
+    """
+    Отменяет расчёты и обновления статуса, удаляет скачанные файлы заказа
+    и снимает его связи в stl_store.
+    """
+    status.finish(chat_id)
+    orders.pop(chat_id, None)
+    order_activity.pop(chat_id, None)
+    reports_in_progress.discard(chat_id)
+    for task in volume_tasks.pop(chat_id, {}).values():
+        task.cancel()
+    jobs.cancel(chat_id)
+    workspace = workspaces.pop(chat_id, None)
+    if workspace is not None:
+        workspace.cleanup()
+        # Связи в stl_store появляются только у заказов с рабочим пространством;
+        # запись в SQLite - вне event loop
+        task = asyncio.create_task(asyncio.to_thread(stl_store.get_store().unlink, workspace.order_id))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+def state_order_id(user_data: dict):
+    return user_data.get('order', {}).get('order_id')
+
+
+async def update_order_state(state: FSMContext, order_id, update) -> dict:
+    """
+    Атомарно меняет данные заказа order_id в FSM: update(data) правит их на месте.
+    Параллельные загрузки и расчёты не затирают изменения друг друга.
+    Возвращает новые данные или None, если в состоянии уже другой заказ (сброшен).
+    """
+    def apply(data):
+        if state_order_id(data) != order_id:
+            return None
+        update(data)
+        return data
+    return await transform_data(state.storage, state.key, apply)
+
+
+async def get_order(chat_id, state: FSMContext) -> Order:
+    """
+    Заказ чата. Обычно берётся из памяти процесса и обновляется по месту;
+    из FSM-состояния разбирается заново только после перезапуска или
+    если заказ ведёт другой процесс бота.
+    """
+    user_data = await state.get_data()
+    order_activity[chat_id] = time.monotonic()
+    order = orders.get(chat_id)
+    if order is None or order.order_id != state_order_id(user_data):
+        order = Order.from_state(user_data)
+        if order is not None:
+            orders[chat_id] = order
+        return order
+    # Загрузки, которые принял другой процесс бота
+    version = user_data.get('received_version', 0)
+    if version != order.received_version:
+        received = user_data.get('received', {})
+        for part_name in received.keys() - order.received.keys():
+            order.receive(part_name, received[part_name])
+        order.received_version = version
+    return order
+
+
+def bump_received(data):
+    """Отмечает в данных FSM изменение 'received'."""
+    data['received_version'] = data.get('received_version', 0) + 1
+
+
+def sync_received_version(order: Order, data) -> None:
+    """
+    Своё изменение 'received' уже внесено в order: если между ним и записью
+    в FSM никто больше загрузок не менял, сверять заказ заново не нужно.
+    """
+    if data is not None and data.get('received_version', 0) == order.received_version + 1:
+        order.received_version = data['received_version']
+
+
+async def compute_part_volume(chat_id, user_id, source, file_hash, part_name, order_id, state: FSMContext):
+    """
+    Считает объём детали в пуле процессов (через очередь jobs) и кладёт его в состояние заказа.
+    Масса и цена во всех материалах потом получаются из объёма без повторного расчёта.
+    В цену идёт объём пластика при печати (оболочка + заполнение, если задан PRINT_INFILL).
+    source - содержимое STL (bytes) или путь к файлу в stl_store, file_hash - его хэш.
+    """
+    with metrics.span('volume_compute'):
+        job = await jobs.run(user_id, chat_id, 'volume', run_in_pool,
+                             tasks.mass_job, source, MATERIALS[DEFAULT_MATERIAL]["density"], None, file_hash)
+    for stage, seconds in job['timings'].items():
+        metrics.observe(stage, seconds)
+    metrics.inc('files_processed_total')
+    metrics.inc('bytes_processed_total', job['bytes'])
+    metrics.inc('triangles_processed_total', job['triangles'])
+    metrics.inc('mass_cache_hits_total' if job['cached'] else 'mass_cache_misses_total')
+
+    def add_volume(data):
+        data.setdefault('volumes', {})[part_name] = job['print_volume_cm3']
+        data.setdefault('hashes', {})[part_name] = job['hash']
+
+    # Пока считали, заказ мог быть сброшен
+    if await update_order_state(state, order_id, add_volume) is None:
+        return
+    order = orders.get(chat_id)
+    if order is not None and order.order_id == order_id:
+        order.volumes[part_name] = job['print_volume_cm3']
+        order.hashes[part_name] = job['hash']
+    if not job['fits_bed']:
+        size = '×'.join(f"{x:.0f}" for x in job['geometry']['size_mm'])
+        await bot.send_message(chat_id=chat_id, text=f"Деталь {part_name} ({size} мм) не помещается "
+                                                      f"на стол принтера ни в одном положении.")
+
+
+async def run_in_pool(func, *args):
+    """
+    Выполняет func(*args) в пуле процессов. Если воркер умер (например, его
+    убил OOM killer), пул ломается целиком: он пересоздаётся и прогревается
+    заново, а задачи, попавшие на сломанный пул, завершаются BrokenProcessPool.
+    """
+    global report_executor
+    executor = report_executor
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # Пересоздаёт только первая из задач сломанного пула
+        if executor is report_executor:
+            print("Пул процессов сломан, пересоздаю")
+            metrics.inc('pool_restarts_total')
+            report_executor = make_executor()
+            executor.shutdown(wait=False)
+            background_tasks.add(asyncio.create_task(warm_up_workers()))
+        raise
+
+
+def start_volume_task(chat_id, user_id, source, file_hash, part_name, order_id, state: FSMContext):
+    old_task = volume_tasks[chat_id].get(part_name)
+    if old_task:
+        old_task.cancel()  # Деталь загрузили повторно
+    volume_tasks[chat_id][part_name] = asyncio.create_task(
+        compute_part_volume(chat_id, user_id, source, file_hash, part_name, order_id, state)
+    )
+
+
+def store_part(order_id, part_name, source, keep_bytes: bool = True) -> tuple:
+    """
+    Кладёт скачанную деталь в хранилище по хэшу и связывает с заказом.
+    Возвращает (хэш, источник для расчёта): bytes остаются в памяти
+    (keep_bytes=False - расчёт прочитает файл из хранилища), большой
+    временный файл переносится в хранилище и читается оттуда.
+    """
+    store = stl_store.get_store()
+    file_hash, path, existed = store.put(source)
+    store.link(order_id, part_name, file_hash)
+    if existed:
+        metrics.inc('stl_store_dedup_total')
+    if not keep_bytes or not isinstance(source, (bytes, bytearray)):
+        source = path
+    return file_hash, source
+
 
 # === Клавиатуры ===
 def get_done_keyboard():
@@ -44,162 +306,273 @@ def get_main_keyboard():
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True, one_time_keyboard=True)
 
-# === Проверка формата сообщения ===
-# def parse_order(text: str):
-#     lines = text.strip().split('\n')
-#     items = []
-#     for line in lines:
-#         match = re.match(r'^([a-zA-Zа-яА-ЯёЁ0-9_-]+)\s+(\d+)$', line.strip())
-#         if not match:
-#             return None
-#         name, count = match.groups()
-#         items.append((name, int(count)))
-#     return items
-def parse_order(text: str):
-    lines = text.strip().split('\n')
-    items = []
-    for line in lines:
-        line = line.strip()
-        # Ищем последнее слово, состоящее только из цифр, в конце строки
-        match = re.match(r'^(.+?)\s+(\d+)$', line)
-        if not match:
-            return None
-        name, count = match.groups()
-        items.append((name.strip(), int(count)))
-    return items
-
-# === Функция обновления кнопки с задержкой и удалением старого сообщения ===
-async def delayed_update_button(chat_id, state: FSMContext):
-    global pending_updates
-
-    if pending_updates[chat_id]:
-        pending_updates[chat_id].cancel()
+# === Текст статусного сообщения заказа ===
+STATUS_LIST_LIMIT = 20  # сколько недостающих деталей показывать в статусе
 
-    async def update():
-        await asyncio.sleep(1.5)  # Ждем 1.5 секунды после последнего файла
-        user_data = await state.get_data()
-        done_msg_id = user_data.get('done_msg_id')
-
-        # Удаляем старое сообщение с кнопкой
-        if done_msg_id:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=done_msg_id)
-            except Exception:
-                pass  # Сообщение могло быть удалено вручную
 
-        # Отправляем новое сообщение с кнопкой
-        msg = await bot.send_message(chat_id=chat_id, text="Когда загрузите все файлы, нажмите кнопку ниже.", reply_markup=get_done_keyboard())
-        await state.update_data(done_msg_id=msg.message_id)
-        pending_updates[chat_id] = None
-
-    task = asyncio.create_task(update())
-    pending_updates[chat_id] = task
+def format_status(order: Order) -> str:
+    lines = order.missing(STATUS_LIST_LIMIT)
+    if order.missing_count > STATUS_LIST_LIMIT:
+        lines.append(f"... и ещё {order.missing_count - STATUS_LIST_LIMIT}")
+    total = len(order.index)
+    done = total - order.missing_count
+    return (f"Загружено {done} из {total}\\.\nОсталось:\n{code('\n'.join(lines) or 'все файлы загружены!')}\n"
+            f"Когда загрузите все файлы, нажмите кнопку ниже\\.")
 
 # === Обработчик команды /start ===
 @dp.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
+    close_order(message.chat.id)
     await state.clear()
     await message.answer(
         "Введите список имен деталей без расширения в формате:\n"
         "ИмяДеталь1 количество\n"
         "ИмяДеталь2 количество\n"
-        "..."
+        "...\n"
+        f"После количества можно указать материал ({', '.join(MATERIALS)}), "
+        f"по умолчанию {DEFAULT_MATERIAL}."
     )
     await state.set_state(OrderState.waiting_for_order)
 
 # === Обработка сообщения с заказом ===
 @dp.message(OrderState.waiting_for_order)
 async def process_order(message: Message, state: FSMContext):
-    text = message.text
-    items = parse_order(text)
+    # Заказ разбирается один раз, дальше по конвейеру идёт Order
+    order = Order.parse(message.text or '')
 
-    if items is None:
+    if order is None:
         await message.answer(
             "Неверный формат. Пожалуйста, введите снова.",
             reply_markup=get_main_keyboard()
         )
         return
 
-    names = [item[0] for item in items]
-    await state.update_data(order_text=text, required_files=names, received_files=[])
+    names = order.required_names
+    orders[message.chat.id] = order
+    order_activity[message.chat.id] = time.monotonic()
+    await state.update_data(**order.to_state())
     await message.answer(f"Принято\\. Теперь загрузите файлы:\n{code('\n'.join(names))}", parse_mode="MarkdownV2")
     msg = await message.answer("Когда загрузите все файлы, нажмите кнопку ниже.", reply_markup=get_done_keyboard())
-    await state.update_data(done_msg_id=msg.message_id)
+    status.attach(message.chat.id, msg.message_id)
     await state.set_state(OrderState.waiting_for_files)
 
 # === Обработка загрузки файлов ===
 @dp.message(OrderState.waiting_for_files, F.document)
 async def handle_document(message: Message, state: FSMContext):
-    user_data = await state.get_data()
-    required_files = set(user_data['required_files'])
-    received_files = user_data.get('received_files', [])
+    order = await get_order(message.chat.id, state)
+    if order is None:
+        return
+    order_id = order.order_id
     file_info = message.document
     file_name = file_info.file_name
 
     # Проверка расширения
-    if not file_name.lower().endswith('.stl'):
-        await message.answer(f"Файл {file_name} не является STL. Пропущен.")
+    archive = is_archive(file_name)
+    if not archive and not file_name.lower().endswith('.stl'):
+        await message.answer(f"Файл {file_name} не является STL или архивом. Пропущен.")
         return
 
-    # Сохранение файла
-    file_path = os.path.join('data', 'stl', file_name)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # Слишком большие файлы отклоняем сразу, не скачивая
+    try:
+        downloads.check_size(file_info.file_size)
+    except FileTooLarge as e:
+        await message.answer(f"{file_name}: {e}. Пропущен.")
+        return
 
-    file = await bot.get_file(file_info.file_id)
-    await bot.download_file(file.file_path, file_path)
+    # Скачивание в рабочее пространство заказа (в память или во временную папку)
+    part_name = os.path.splitext(file_name)[0]
+    workspace = get_workspace(message.chat.id, order_id)
+    destination = workspace.destination(file_name, file_info.file_size)
 
-    received_files.append(file_name)
-    await state.update_data(received_files=received_files)
+    try:
+        with metrics.span('telegram_download'):
+            await downloads.download(message.chat.id, file_info.file_id, destination, file_info.file_size)
+    except FileTooLarge as e:
+        await message.answer(f"{file_name}: {e}. Пропущен.")
+        return
+    except Exception as e:
+        print(f"Ошибка скачивания {file_name}: {e!r}")
+        metrics.inc('download_errors_total')
+        await message.answer(f"Не удалось скачать {file_name}, отправьте файл ещё раз.")
+        return
 
-    uploaded_names = {os.path.splitext(f)[0] for f in received_files}
-    missing = required_files - uploaded_names
-    await message.answer(f"Файл {code(file_name)} загружен\\.\nОсталось:\n{code('\n'.join(missing) or 'все файлы загружены!')}", parse_mode="MarkdownV2")
+    if archive:
+        # Архив считается одной загрузкой: все подходящие STL из него
+        # распаковываются потоком, каждый сразу уходит в хранилище (в памяти
+        # не копятся) и на расчёт
+        data = destination.getvalue() if isinstance(destination, io.BytesIO) else destination
 
-    # Откладываем обновление кнопки (с удалением старого сообщения)
-    await delayed_update_button(message.chat.id, state)
+        def store_member(part_name, source):
+            return store_part(order_id, part_name, source, keep_bytes=False)
+        try:
+            with metrics.span('archive_extract'):
+                extracted, skipped = await asyncio.to_thread(
+                    extract_stl_members, data, file_name, order.index.keys(), workspace, store_member
+                )
+        except Exception as e:
+            await message.answer(f"Не удалось распаковать архив {file_name}: {e}")
+            return
+        finally:
+            if not isinstance(destination, io.BytesIO):
+                os.remove(destination)
+        del data
+        if skipped:
+            await message.answer(f"Из архива {file_name} пропущено файлов: {len(skipped)}.")
+        stored = [(part_name, member_name, *result) for part_name, member_name, result in extracted]
+    else:
+        # Деталь - в хранилище по хэшу: одинаковое содержимое хранится и считается один раз
+        with metrics.span('stl_store'):
+            stored = [(part_name, file_name,
+                       *await asyncio.to_thread(store_part, order_id, part_name, workspace.source(destination)))]
+
+    # Пока качали, заказ могли сбросить, а другие файлы - уже отметить
+    order = await get_order(message.chat.id, state)
+    if order is None or order.order_id != order_id:
+        return
+    for part_name, member_name, file_hash, source in stored:
+        order.receive(part_name, member_name)
+        # Объём считается сразу, пока пользователь загружает остальные файлы
+        start_volume_task(message.chat.id, message.from_user.id, source, file_hash, part_name, order_id, state)
+
+    def add_received(data):
+        received = data.setdefault('received', {})
+        for part_name, member_name, *_ in stored:
+            received[part_name] = member_name
+        bump_received(data)
+    sync_received_version(order, await update_order_state(state, order_id, add_received))
+
+    # Статус обновляется с задержкой: пачка файлов даст одно редактирование
+    status.update(message.chat.id, format_status(order),
+                  reply_markup=get_done_keyboard(), parse_mode="MarkdownV2")
 
 # === Обработка нажатия кнопки "Завершить загрузку" ===
 @dp.callback_query(F.data == "done_uploading")
 async def process_done_uploading(callback: types.CallbackQuery, state: FSMContext):
-    user_data = await state.get_data()
-    required_files = set(user_data['required_files'])
-    received_files = user_data.get('received_files', [])
-    uploaded_names = {os.path.splitext(f)[0] for f in received_files}
-
-    missing = required_files - uploaded_names
-    extra = uploaded_names - required_files
-
-    if missing:
-        done_msg_id = user_data.get('done_msg_id')
-        if done_msg_id:
-            try:
-                await bot.delete_message(chat_id=callback.message.chat.id, message_id=done_msg_id)
-            except Exception:
-                pass
-        msg = await callback.message.answer(f"Не загружены:\n{code('\n'.join(missing))}", reply_markup=get_done_keyboard(), parse_mode="MarkdownV2")
-        await state.update_data(done_msg_id=msg.message_id)
+    chat_id = callback.message.chat.id
+    if chat_id in reports_in_progress:
+        await callback.answer("Чек уже формируется")
+        return
+    order = await get_order(chat_id, state)
+    if order is None:
+        await callback.answer()
+        return
+
+    if order.missing_count:
+        status.update(chat_id, f"Не загружены:\n{code('\n'.join(order.missing(STATUS_LIST_LIMIT)))}", delay=0,
+                      reply_markup=get_done_keyboard(), parse_mode="MarkdownV2")
         await callback.answer()
         return
-    if extra:
-        done_msg_id = user_data.get('done_msg_id')
-        if done_msg_id:
-            try:
-                await bot.delete_message(chat_id=callback.message.chat.id, message_id=done_msg_id)
-            except Exception:
-                pass
-        msg = await callback.message.answer(f"Лишние файлы: {', '.join(extra)}.", reply_markup=get_done_keyboard())
-        await state.update_data(done_msg_id=msg.message_id)
+    if order.extra:
+        status.update(chat_id, f"Лишние файлы: {', '.join(sorted(order.extra))}.", delay=0,
+                      reply_markup=get_done_keyboard())
         await callback.answer()
         return
 
-    order_text = user_data['order_text']
-    # Вызов вашей функции
-    receipt.set_data(order_text)
-    receipt.generate_report()
-    # MyFUNC(order_text)
+    await callback.answer("Формирую чек...")
+    reports_in_progress.add(chat_id)
+    try:
+        await send_receipt(callback, state, order)
+    finally:
+        # Флаг снимается на любом выходе, иначе чат навсегда получал бы "Чек уже формируется"
+        reports_in_progress.discard(chat_id)
+
+
+async def send_receipt(callback: types.CallbackQuery, state: FSMContext, order: Order):
+    """Дожидается объёмов деталей, собирает (или берёт из кэша) чек и отправляет его."""
+    chat_id = callback.message.chat.id
+    order_start = time.perf_counter()
+    required = order.index.keys()
+
+    # Дожидаемся фоновых расчётов объёмов (обычно к этому моменту уже готовы)
+    pending = volume_tasks.pop(chat_id, {})
+    with metrics.span('wait_volumes'):
+        results = await asyncio.gather(*pending.values(), return_exceptions=True)
+    failed = set()
+    for part_name, result in zip(pending, results):
+        if isinstance(result, Exception) and not isinstance(result, JobCancelled):
+            print(f"Ошибка расчёта объёма {part_name}: {result!r}")
+            failed.add(part_name)
+    user_data = await state.get_data()
+
+    # Пока ждём, заказ могут сбросить кнопкой "Создать новый заказ" (close_order
+    # убирает его из orders, в состоянии появляется другой заказ или ничего)
+    def still_open(user_data):
+        return orders.get(chat_id) is order and state_order_id(user_data) == order.order_id
+
+    # Объёмы деталей, которые принял другой процесс бота, появятся в общем
+    # хранилище (SQLite, Redis); в памяти процесса ждать их неоткуда
+    foreign = set() if isinstance(state.storage, MemoryStorage) else required - pending.keys()
+    deadline = time.monotonic() + FOREIGN_MASS_WAIT_S
+    while still_open(user_data) and foreign - user_data.get('volumes', {}).keys() \
+            and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        user_data = await state.get_data()
+
+    if not still_open(user_data):
+        return
+    volumes = user_data.get('volumes', {})
+
+    # Расчёт мог упасть или потеряться (перезапуск бота) - просим загрузить заново;
+    # объём упавшей детали в состоянии может остаться от прошлой загрузки
+    lost = (required - volumes.keys()) | (required & failed)
+    if lost:
+        for part_name in lost:
+            order.forget(part_name)
+
+        def forget_lost(data):
+            for part_name in lost:
+                for key in ('received', 'volumes', 'hashes'):
+                    data.get(key, {}).pop(part_name, None)
+            bump_received(data)
+        sync_received_version(order, await update_order_state(state, order.order_id, forget_lost))
+        status.update(chat_id, f"Не удалось обработать, загрузите заново:\n{code('\n'.join(sorted(lost)))}",
+                      delay=0, reply_markup=get_done_keyboard(), parse_mode="MarkdownV2")
+        return
+
+    order.volumes = volumes
+    order.hashes.update(user_data.get('hashes', {}))
+
+    # Такой же чек уже собирали - отправим его без сборки, по file_id из Telegram.
+    # Кэш - SQLite (открывается при первом обращении), поэтому вне event loop
+    key = receipt_key(order)
+    cached = await asyncio.to_thread(lambda: receipt_cache.get_cache().get(key)) if key else None
+    if cached is not None:
+        file_id, pdf_bytes = cached
+        metrics.inc('pdf_cache_hits_total')
+    else:
+        file_id = None
+        if key:
+            metrics.inc('pdf_cache_misses_total')
+        # Генерация отчёта в отдельном процессе через общую очередь;
+        # пока чек ждёт, в статусе показываются позиция и время ожидания
+        def on_queue(position, wait):
+            status.update(chat_id, f"Заказ в очереди: {position}-й, ожидание около {math.ceil(wait)} с.")
+
+        try:
+            with metrics.span('report_build'):
+                pdf_bytes, timings = await jobs.run(
+                    callback.from_user.id, chat_id, 'report', run_in_pool, run_profiled,
+                    tasks.build_report, PROFILE_SLOW_ORDERS_S, f"order_{order.order_id}", order.to_state(),
+                    on_queue=on_queue
+                )
+            for stage, seconds in timings.items():
+                metrics.observe(stage, seconds)
+        except QueueFull:
+            status.update(chat_id, "Слишком много ваших заказов в очереди, попробуйте чуть позже.", delay=0,
+                          reply_markup=get_done_keyboard())
+            metrics.inc('orders_rejected_total')
+            return
+        except JobCancelled:
+            return  # Заказ сброшен кнопкой "Создать новый заказ"
+        except Exception as e:
+            print(f"Ошибка генерации чека: {e!r}")
+            metrics.inc('report_errors_total')
+            pdf_bytes = None
+
+    done_msg_id = status.finish(chat_id)
+    close_order(chat_id)
 
     # Удаляем сообщение с кнопкой "Завершить загрузку"
-    done_msg_id = user_data.get('done_msg_id')
     if done_msg_id:
         try:
             await bot.delete_message(chat_id=callback.message.chat.id, message_id=done_msg_id)
@@ -207,19 +580,31 @@ async def process_done_uploading(callback: types.CallbackQuery, state: FSMContex
             pass
 
     # Отправка PDF пользователю
-    pdf_path = os.path.join('data', 'reports', 'output2.pdf')  # замените на реальное имя файла
-    if os.path.exists(pdf_path):
-        await callback.message.answer_document(types.FSInputFile(pdf_path))
+    sent = None
+    if file_id:
+        try:
+            with metrics.span('answer_document'):
+                sent = await callback.message.answer_document(file_id)
+        except TelegramBadRequest:
+            pass  # file_id устарел или выдан другому боту - загрузим файл заново
+    if sent is None and pdf_bytes:
+        with metrics.span('answer_document'):
+            sent = await callback.message.answer_document(types.BufferedInputFile(pdf_bytes, filename="receipt.pdf"))
+        if key and sent.document:
+            await asyncio.to_thread(lambda: receipt_cache.get_cache().put(key, pdf_bytes, sent.document.file_id))
+    if sent is not None:
+        metrics.inc('orders_total')
     else:
         await callback.message.answer("Ошибка: PDF не был сгенерирован.")
 
     await state.clear()
     await callback.message.answer("Готово!", reply_markup=get_main_keyboard())
-    await callback.answer()
+    metrics.observe('done_total', time.perf_counter() - order_start)
 
 # === Обработка команды "Создать новый заказ" (обычная кнопка) ===
 @dp.message(F.text == "Создать новый заказ")
 async def reset_process(message: Message, state: FSMContext):
+    close_order(message.chat.id)
     await state.clear()
     await message.answer(
         "Процесс сброшен. Введите список деталей:",
@@ -230,20 +615,93 @@ async def reset_process(message: Message, state: FSMContext):
 # === Обработка не-документов в состоянии загрузки файлов ===
 @dp.message(OrderState.waiting_for_files)
 async def handle_non_doc(message: Message, state: FSMContext):
-    user_data = await state.get_data()
-    done_msg_id = user_data.get('done_msg_id')
-
-    # Удаляем старое сообщение с кнопкой, если есть
-    if done_msg_id:
+    # Переотправляем статусное сообщение с кнопкой вниз чата
+    status.update(message.chat.id, "Пожалуйста, загрузите файлы или нажмите кнопку завершения.",
+                  repost=True, reply_markup=get_done_keyboard())
+
+
+async def warm_up_workers():
+    """Заранее запускает воркеры пула: каждый при старте прогревается (tasks.warm_up)."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        # Напрямую, не через run_in_pool: пул, который ломается уже при запуске,
+        # пересоздастся следующей задачей, а не бесконечным прогревом
+        await asyncio.gather(*(loop.run_in_executor(report_executor, os.getpid) for _ in range(REPORT_WORKERS)))
+    except BrokenProcessPool as e:
+        print(f"Прогрев пула не удался: {e!r}")
+        return
+    metrics.observe('workers_warm_up', time.perf_counter() - start)
+
+
+async def expire_idle_orders():
+    """
+    Закрывает заказы, в которых ORDER_IDLE_TTL_S ничего не происходило:
+    освобождает скачанные файлы, расчёты и копию заказа в памяти.
+    Состояние в FSM остаётся - если пользователь вернётся, заказ
+    разберётся из него заново.
+    """
+    while True:
+        await asyncio.sleep(min(ORDER_IDLE_TTL_S, 60))
+        now = time.monotonic()
+        for chat_id in orders.keys() | workspaces.keys() | volume_tasks.keys():
+            if chat_id in reports_in_progress:
+                continue
+            if now - order_activity.setdefault(chat_id, now) > ORDER_IDLE_TTL_S:
+                close_order(chat_id)
+                metrics.inc('orders_expired_total')
+
+
+@dp.startup()
+async def start_background():
+    # Прогрев идёт в фоне: бот начинает принимать сообщения сразу
+    background_tasks.add(asyncio.create_task(warm_up_workers()))
+    if ORDER_IDLE_TTL_S:
+        background_tasks.add(asyncio.create_task(expire_idle_orders()))
+    if METRICS_PORT:
         try:
-            await bot.delete_message(chat_id=message.chat.id, message_id=done_msg_id)
-        except Exception:
-            pass
+            await start_http_server(METRICS_PORT)
+        except OSError as e:
+            # В режиме нескольких воркеров порт метрик занимает первый
+            print(f"Эндпоинт метрик не запущен: {e}")
+    if METRICS_LOG_INTERVAL:
+        background_tasks.add(asyncio.create_task(log_periodically(METRICS_LOG_INTERVAL)))
+
+
+async def setup_webhook():
+    async with make_bot() as webhook_bot:
+        await webhook_bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
 
-    # Отправляем новое сообщение с кнопкой
-    msg = await message.answer("Пожалуйста, загрузите файлы или нажмите кнопку завершения.", reply_markup=get_done_keyboard())
-    await state.update_data(done_msg_id=msg.message_id)
+
+def run_webhook():
+    """Один процесс-воркер webhook; порт делится между процессами через SO_REUSEPORT."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    try:
+        web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1)
+    finally:
+        report_executor.shutdown()
 
 
 if __name__ == '__main__':
-    dp.run_polling(bot)
\ No newline at end of file
+    if WEBHOOK_URL:
+        asyncio.run(setup_webhook())
+        if WEBHOOK_WORKERS > 1:
+            # spawn: каждый воркер заново импортирует бота со своим пулом процессов
+            ctx = multiprocessing.get_context('spawn')
+            workers = [ctx.Process(target=run_webhook) for _ in range(WEBHOOK_WORKERS)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            run_webhook()
+    else:
+        try:
+            dp.run_polling(bot)
+        finally:
+            report_executor.shutdown()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import asyncio
+import io
+import random
+from collections import defaultdict
+
+import aiohttp
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import config
+from metrics import metrics
+
+
+# Пределы Bot API на скачивание: облачный сервер отдаёт до 20 МБ,
+# локальный (https://github.com/tdlib/telegram-bot-api) - до 2000 МБ
+CLOUD_MAX_BYTES = 20 * 1024 * 1024
+LOCAL_MAX_BYTES = 2000 * 1024 * 1024
+
+DOWNLOAD_CONCURRENCY = getattr(config, 'DOWNLOAD_CONCURRENCY', 8)
+DOWNLOAD_PER_CHAT = getattr(config, 'DOWNLOAD_PER_CHAT', 2)
+DOWNLOAD_RETRIES = 3
+BACKOFF_S = 1.0
+CHUNK_SIZE = 1024 * 1024
+# Тайм-аут скачивания: базовый плюс время на файл при скорости не ниже 256 КБ/с
+BASE_TIMEOUT_S = 30
+MIN_SPEED = 256 * 1024
+
+
+class FileTooLarge(Exception):
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Файл {size / 2 ** 20:.1f} МБ больше допустимых {limit // 2 ** 20} МБ")
+        self.size = size
+        self.limit = limit
+
+
+class DownloadManager:
+    """
+    Скачивание файлов из Telegram с ограничением параллельности:
+    общий семафор на процесс и свой на каждый чат, чтобы пачка файлов
+    из одного чата не занимала все слоты. Сетевые ошибки повторяются
+    с экспоненциальной задержкой, файлы больше предела отклоняются
+    до скачивания. Файл пишется в destination потоком, блоками CHUNK_SIZE.
+    """
+
+    def __init__(self, bot, max_concurrent: int = DOWNLOAD_CONCURRENCY, per_chat: int = DOWNLOAD_PER_CHAT,
+                 retries: int = DOWNLOAD_RETRIES, max_bytes: int = None):
+        self.bot = bot
+        self.retries = retries
+        if max_bytes is None:
+            max_bytes = LOCAL_MAX_BYTES if bot.session.api.is_local else CLOUD_MAX_BYTES
+        self.max_bytes = min(max_bytes, getattr(config, 'MAX_FILE_MB', max_bytes // 2 ** 20) * 2 ** 20)
+        self.per_chat = per_chat
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._chats = {}  # chat_id -> Semaphore
+        self._chat_users = defaultdict(int)  # chat_id -> сколько скачиваний ждут или идут
+
+    def check_size(self, file_size) -> None:
+        """Отклоняет файл до скачивания, если он больше предела."""
+        if file_size is not None and file_size > self.max_bytes:
+            metrics.inc('downloads_rejected_total')
+            raise FileTooLarge(file_size, self.max_bytes)
+
+    async def download(self, chat_id, file_id: str, destination, file_size: int = None) -> None:
+        """
+        Скачивает файл в destination (BytesIO или путь).
+        Бросает FileTooLarge и последнюю ошибку, если попытки кончились.
+        """
+        self.check_size(file_size)
+        semaphore = self._chats.get(chat_id)
+        if semaphore is None:
+            semaphore = self._chats[chat_id] = asyncio.Semaphore(self.per_chat)
+        self._chat_users[chat_id] += 1
+        try:
+            async with semaphore, self._global:
+                await self._download_with_retries(file_id, destination, file_size)
+        finally:
+            self._chat_users[chat_id] -= 1
+            if not self._chat_users[chat_id]:
+                del self._chat_users[chat_id]
+                self._chats.pop(chat_id, None)
+
+    async def _download_with_retries(self, file_id: str, destination, file_size) -> None:
+        timeout = BASE_TIMEOUT_S + (file_size or 0) // MIN_SPEED
+        for attempt in range(self.retries + 1):
+            try:
+                file = await self.bot.get_file(file_id)
+                self.check_size(file.file_size)
+                if isinstance(destination, io.BytesIO):
+                    # Повторная попытка пишет файл с начала
+                    destination.seek(0)
+                    destination.truncate()
+                await self.bot.download_file(file.file_path, destination, timeout=timeout, chunk_size=CHUNK_SIZE)
+                return
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                delay = e.retry_after
+            except TelegramBadRequest as e:
+                if 'too big' in str(e):
+                    metrics.inc('downloads_rejected_total')
+                    raise FileTooLarge(file_size or 0, self.max_bytes) from e
+                raise
+            except (TelegramNetworkError, TelegramServerError, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = BACKOFF_S * 2 ** attempt * (1 + random.random())
+                print(f"Ошибка скачивания ({e!r}), повтор через {delay:.1f} с")
+            metrics.inc('download_retries_total')
+            await asyncio.sleep(delay)
@@ -1,48 +1,147 @@
+import argparse
 import os
 import re
 import math
+import mmap
+import time
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.pagesizes import A6
+from reportlab.lib.utils import simpleSplit
 from datetime import datetime
 from typing import Dict
 from config import executor, customer
 
 
+# Окна в начале и конце файла, где слайсеры пишут статистику
+HEAD_WINDOW = 64 * 1024
+TAIL_WINDOW = 256 * 1024
+SCAN_CHUNK = 1024 * 1024
+
+# Форматы комментариев PrusaSlicer / OrcaSlicer (Bambu) / Cura
+_NUMBERS = rb"(\d+(?:\.\d+)?(?:\s*,\s*\d+(?:\.\d+)?)*)"
+GCODE_PATTERNS = {
+    # ; filament used [g] = 3.72 / ; total filament weight [g] : 3.72
+    'weight_g': re.compile(rb"^;\s*(?:total\s+)?filament\s+(?:used|weight)\s*\[g\]\s*[=:]\s*" + _NUMBERS, re.M | re.I),
+    # ; filament used [mm] = 1234.5 / ; total filament length [mm] : 1234.5
+    'length_mm': re.compile(rb"^;\s*(?:total\s+)?filament\s+(?:used|length)\s*\[mm\]\s*[=:]\s*" + _NUMBERS, re.M | re.I),
+    # Cura: ;Filament used: 1.23456m
+    'length_m': re.compile(rb"^;\s*filament used:\s*" + _NUMBERS + rb"\s*m\b", re.M | re.I),
+    # ; filament cost = 0.09 / ; total filament cost = 0.09
+    'cost': re.compile(rb"^;\s*(?:total\s+)?filament\s+cost\s*[=:]\s*" + _NUMBERS, re.M | re.I),
+    'diameter_mm': re.compile(rb"^;\s*filament_diameter\s*=\s*" + _NUMBERS, re.M),
+    'density_g_cm3': re.compile(rb"^;\s*filament_density\s*=\s*" + _NUMBERS, re.M),
+}
+
+DEFAULT_FILAMENT_DIAMETER = 1.75  # мм
+DEFAULT_FILAMENT_DENSITY = 1.24  # г/см³, PLA
+
+GCODE_EXTENSIONS = ('.gcode', '.gco', '.g')
+PAGE_BOTTOM = 50  # ниже - подписи исполнителя и заказчика
+
+
+def _parse_numbers(raw: bytes) -> float:
+    # Для нескольких экструдеров слайсер пишет значения через запятую
+    return sum(float(x) for x in raw.split(b','))
+
+
+def _search_window(data, info: dict) -> None:
+    for key, pattern in GCODE_PATTERNS.items():
+        if info.get(key) is None:
+            match = pattern.search(data)
+            if not match:
+                continue
+            if key in ('diameter_mm', 'density_g_cm3'):
+                info[key] = float(match.group(1).split(b',')[0])
+            else:
+                info[key] = _parse_numbers(match.group(1))
+
+
+def extract_filament_info(gcode_path) -> dict:
+    """
+    Достаёт из G-code вес, длину и стоимость филамента.
+
+    Файл не читается целиком: сначала просматриваются хвост (куда
+    PrusaSlicer/OrcaSlicer пишут статистику) и начало файла (заголовок
+    Cura/OrcaSlicer), и только если вес там не найден - потоковый проход
+    по всему файлу блоками фиксированного размера.
+
+    Возвращает:
+        dict: {'weight_g', 'length_mm', 'cost', 'diameter_mm', 'density_g_cm3'},
+              отсутствующие значения - None.
+    """
+    info = dict.fromkeys(GCODE_PATTERNS)
+    size = os.path.getsize(gcode_path)
+
+    with open(gcode_path, 'rb') as file:
+        if size > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _search_window(mm[max(0, size - TAIL_WINDOW):], info)
+                _search_window(mm[:HEAD_WINDOW], info)
+
+        if info['weight_g'] is None and info['length_mm'] is None and info['length_m'] is None \
+                and size > HEAD_WINDOW + TAIL_WINDOW:
+            # Запасной вариант: проход по файлу с ограниченным расходом памяти
+            file.seek(0)
+            tail = b''
+            for block in iter(lambda: file.read(SCAN_CHUNK), b''):
+                data = tail + block
+                cut = data.rfind(b'\n') + 1
+                # Регулярки гоняем только по блокам, где вообще есть нужные комментарии
+                if b'ilament' in data[:cut]:
+                    _search_window(data[:cut], info)
+                tail = data[cut:]
+            _search_window(tail, info)
+
+    if info['length_mm'] is None and info['length_m'] is not None:
+        info['length_mm'] = info['length_m'] * 1000
+    del info['length_m']
+    return info
+
+
 def extract_filament_weight(gcode_path):
-    with open(gcode_path, 'r', encoding='utf-8') as file:
-        gcode_content = file.read()
+    info = extract_filament_info(gcode_path)
+    if info['weight_g'] is not None:
+        return info['weight_g']
 
-    # Поиск шаблона для веса в граммах
-    pattern = r"filament used\s*\[g\]\s*=\s*(\d+\.\d+)"
-    match = re.search(pattern, gcode_content)
+    # Cura пишет только длину - пересчитываем в граммы
+    if info['length_mm'] is not None:
+        diameter = info['diameter_mm'] or DEFAULT_FILAMENT_DIAMETER
+        density = info['density_g_cm3'] or DEFAULT_FILAMENT_DENSITY
+        volume_cm3 = math.pi * (diameter / 2) ** 2 * info['length_mm'] / 1000
+        return volume_cm3 * density
 
-    if match:
-        weight = float(match.group(1))
-        return weight
-    else:
-        return None
+    return None
 
-def generate_pdf_receipt(data: Dict[str, int],
-                         price: float,
-                         executor: str,
-                         customer: str) -> None:
+@lru_cache(maxsize=None)
+def register_fonts() -> tuple:
+    """Регистрирует шрифты один раз на процесс. Возвращает (обычный, жирный)."""
     try:
         pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
         pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', 'DejaVuSans-Bold.ttf'))
-        font_name = 'DejaVuSans'
-        font_bold = 'DejaVuSans-Bold'
+        return 'DejaVuSans', 'DejaVuSans-Bold'
     except:
-        font_name = 'Helvetica'
-        font_bold = 'Helvetica-Bold'
+        return 'Helvetica', 'Helvetica-Bold'
+
+
+def generate_pdf_receipt(data: Dict[str, int],
+                         price: float,
+                         executor: str,
+                         customer: str,
+                         output_path: str = None) -> None:
+    font_name, font_bold = register_fonts()
 
     title = "Квитанция об оплате"
 
     total_price = 0
     date = datetime.today().date()
 
-    c = canvas.Canvas(f"{date}.pdf", pagesize=A6)
+    if output_path is None:
+        output_path = f"{date}.pdf"
+    c = canvas.Canvas(output_path, pagesize=A6)
     width, height = A6
     # Заголовок
     c.setFont(font_bold, 16)
@@ -57,16 +156,28 @@ def generate_pdf_receipt(data: Dict[str, int],
     c.setFont(font_name, 10)
     c.drawString(15, height - 65, f"Цена за грамм: {price} руб.")
 
-    # Список деталей
+    # Список деталей; длинные строки переносим по ширине страницы,
+    # при нехватке места - на следующую страницу
     y_position = height - 85
+    c.setFont(font_name, 10)
     for key, value in data.items():
-
         elem_price = value * price
         total_price += elem_price
 
-        c.setFont(font_name, 10)
-        c.drawString(15, y_position, f"{key} - {value} г. - {elem_price} руб.")
-        y_position -= 15
+        for line in simpleSplit(f"{key} - {value} г. - {elem_price} руб.", font_name, 10, width - 30):
+            if y_position < PAGE_BOTTOM:
+                c.showPage()
+                c.setFont(font_bold, 12)
+                c.drawString(15, height - 20, "Список печатаемых изделий (продолжение)")
+                c.setFont(font_name, 10)
+                y_position = height - 45
+            c.drawString(15, y_position, line)
+            y_position -= 15
+
+    # Итого и подписи должны поместиться над нижним краем
+    if y_position - 10 < PAGE_BOTTOM:
+        c.showPage()
+        y_position = height - 20
 
     # Итого
     c.setFont(font_bold, 12)
@@ -78,28 +189,72 @@ def generate_pdf_receipt(data: Dict[str, int],
     c.drawString(width - 150, 15, f"Заказчик: {customer}")
 
     c.save()
-    print(f"Чек создан: {date}.pdf")
+    print(f"Чек создан: {output_path}")
+
+def find_gcode_files(path: str, recursive: bool = False) -> list:
+    """Список G-code файлов в папке (с подпапками при recursive), без каталогов и прочих файлов."""
+    if not recursive:
+        return sorted(
+            os.path.join(path, file) for file in os.listdir(path)
+            if file.lower().endswith(GCODE_EXTENSIONS) and os.path.isfile(os.path.join(path, file))
+        )
 
-def main():
-    path = "./data"
-    files = os.listdir(path)
+    found = []
+    for root, _, files in os.walk(path):
+        found.extend(os.path.join(root, file) for file in files if file.lower().endswith(GCODE_EXTENSIONS))
+    return sorted(found)
+
+
+def timed_extract(gcode_path):
+    start = time.perf_counter()
+    weight = extract_filament_weight(gcode_path)
+    return gcode_path, weight, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Чек по весу филамента из G-code файлов")
+    parser.add_argument("path", nargs="?", default="./data", help="папка с G-code файлами")
+    parser.add_argument("--batch", action="store_true",
+                        help="обойти папку рекурсивно и извлечь веса параллельно на всех ядрах")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов в режиме --batch")
+    parser.add_argument("--price", type=float, default=2, help="цена за грамм, руб.")
+    parser.add_argument("--output", default=None, help="имя PDF (по умолчанию <дата>.pdf)")
+    args = parser.parse_args(argv)
+
+    path = args.path
+    files = find_gcode_files(path, recursive=args.batch)
+
+    if args.batch:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(timed_extract, files, chunksize=16))
+    else:
+        results = [timed_extract(file) for file in files]
 
     data = dict()
 
-    for file in files:
-        weight = extract_filament_weight(f"{path}/{file}")
+    for file, weight, _ in results:
         if weight is not None:
-            data[file.split("_PETG")[0]] = math.ceil(weight)
+            name = os.path.relpath(file, path)
+            data[name.split("_PETG")[0]] = math.ceil(weight)
             print(f"Вес модели: {math.ceil(weight)} г")
         else:
-            print("Данные о весе не найдены в G-code")
+            print(f"Данные о весе не найдены в G-code: {file}")
+
+    if args.batch:
+        print("Время извлечения по файлам:")
+        for file, weight, elapsed in sorted(results, key=lambda r: r[2], reverse=True):
+            print(f"  {elapsed * 1000:8.1f} мс  {file}")
+        total = sum(r[2] for r in results)
+        print(f"Файлов: {len(results)}, с весом: {len(data)}, суммарно {total:.2f} с")
 
     generate_pdf_receipt(
         data,
-        2,
+        args.price,
         executor,
-        customer
+        customer,
+        args.output
     )
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,132 @@
+import asyncio
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROFILES_DIR = os.path.join('data', 'profiles')
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Простые метрики процесса бота: гистограммы длительности стадий и счётчики.
+    Отдаются в текстовом формате Prometheus (render) или одной JSON-строкой в лог.
+    """
+
+    def __init__(self):
+        self.stages = {}  # стадия -> Histogram
+        self.counters = {}  # имя -> число
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage: str):
+        """Замеряет время блока: with metrics.span('telegram_download'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP receipt_stage_seconds Длительность стадий обработки заказа",
+            "# TYPE receipt_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'receipt_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'receipt_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'receipt_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE receipt_{name} counter")
+                lines.append(f"receipt_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'stages': {
+                    stage: {'count': h.count, 'avg_s': h.sum / h.count if h.count else 0.0}
+                    for stage, h in self.stages.items()
+                },
+            }
+
+
+metrics = Metrics()
+
+
+async def start_http_server(port: int, host: str = '127.0.0.1'):
+    """Поднимает локальный HTTP-эндпоинт /metrics (формат Prometheus)."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def log_periodically(interval: float):
+    """Раз в interval секунд печатает метрики одной JSON-строкой."""
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({'metrics': metrics.snapshot()}, ensure_ascii=False))
+
+
+def run_profiled(func, threshold_s, name, *args):
+    """
+    Выполняет func(*args) под cProfile и, если вызов занял дольше
+    threshold_s секунд, сохраняет профиль в data/profiles/<name>_<время>.prof.
+    При threshold_s=None профилирование выключено.
+    """
+    if threshold_s is None:
+        return func(*args)
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    result = profiler.runcall(func, *args)
+    elapsed = time.perf_counter() - start
+    if elapsed >= threshold_s:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = os.path.join(PROFILES_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        print(f"Медленный заказ ({elapsed:.2f} с), профиль: {path}")
+    return result
@@ -0,0 +1,151 @@
+import re
+import uuid
+from itertools import islice
+
+import config
+
+
+# Таблица материалов: плотность, г/см³ и цена за грамм, р/г.
+# Переопределяется через config.MATERIALS, материал по умолчанию - config.DEFAULT_MATERIAL
+MATERIALS = getattr(config, 'MATERIALS', {
+    "PETG": {"density": 1.3, "price": 2},
+    "PLA": {"density": 1.24, "price": 5},
+})
+DEFAULT_MATERIAL = getattr(config, 'DEFAULT_MATERIAL', "PETG")
+# Показывать в чеке сравнение стоимости заказа во всех материалах
+COMPARE_MATERIALS = getattr(config, 'COMPARE_MATERIALS', False)
+
+_ORDER_LINE = re.compile(r'^(.+?)\s+(\d+)(?:\s+(\S+))?$')
+
+
+def split_order_line(line: str):
+    """
+    Разбирает строку заказа "имя количество [материал]".
+
+    Возвращает:
+        tuple: (имя, количество, материал) или None, если строка не подходит.
+               Если последнее слово не является известным материалом,
+               оно считается частью имени.
+    """
+    line = line.strip()
+    match = _ORDER_LINE.match(line)
+    if match and match.group(3):
+        material = match.group(3).upper()
+        if material in MATERIALS:
+            return match.group(1).strip(), int(match.group(2)), material
+    match = re.match(r'^(.+?)\s+(\d+)$', line)
+    if not match:
+        return None
+    return match.group(1).strip(), int(match.group(2)), DEFAULT_MATERIAL
+
+
+class OrderItem:
+    __slots__ = ('name', 'count', 'material')
+
+    def __init__(self, name: str, count: int, material: str = DEFAULT_MATERIAL):
+        self.name = name
+        self.count = count
+        self.material = material
+
+    def __repr__(self):
+        return f"OrderItem({self.name!r}, {self.count}, {self.material!r})"
+
+
+class Order:
+    """
+    Заказ: строки разбираются один раз (Order.parse) и дальше модель
+    передаётся по всему конвейеру - от бота до Receipt.
+
+    Индекс нужных деталей и множество ещё не загруженных обновляются
+    за O(1) на каждую загрузку (receive), поэтому большие заказы
+    обрабатываются за линейное время.
+
+    В FSM-состоянии хранится в виде простых данных (to_state/from_state):
+    'order' - неизменяемая часть, 'received', 'volumes' и 'hashes' - отдельными
+    ключами, чтобы загрузки и расчёты обновляли их независимо.
+    'received_version' растёт при каждом изменении 'received': по нему копия
+    заказа в памяти видит, что загрузки принял другой процесс бота.
+    """
+
+    __slots__ = ('order_id', 'items', 'index', 'received', 'received_version', 'volumes', 'hashes', 'extra',
+                 '_missing')
+
+    def __init__(self, items, order_id: str = None):
+        self.order_id = order_id or uuid.uuid4().hex
+        self.items = items
+        self.index = {item.name: item for item in items}  # имя детали -> строка заказа
+        self.received = {}  # имя детали -> имя загруженного файла
+        self.received_version = 0  # версия 'received' в FSM, с которой сверен заказ
+        self.volumes = {}  # имя детали -> объём, см³
+        self.hashes = {}  # имя детали -> sha256 содержимого файла
+        self.extra = set()  # загруженные детали, которых нет в заказе
+        self._missing = dict.fromkeys(self.index)  # упорядоченное множество
+
+    @classmethod
+    def parse(cls, text: str):
+        """Разбирает текст заказа; пустые строки пропускаются. None - если формат неверный."""
+        items = []
+        for line in text.split('\n'):
+            if not line.strip():
+                continue
+            parsed = split_order_line(line)
+            if parsed is None:
+                return None
+            items.append(OrderItem(*parsed))
+        if not items:
+            return None
+        return cls(items)
+
+    @property
+    def required_names(self) -> list:
+        return list(self.index)
+
+    def receive(self, part_name: str, file_name: str) -> bool:
+        """Отмечает загруженный файл. Возвращает True, если деталь есть в заказе."""
+        self.received[part_name] = file_name
+        if part_name not in self.index:
+            self.extra.add(part_name)
+            return False
+        self._missing.pop(part_name, None)
+        return True
+
+    def forget(self, part_name: str) -> None:
+        """Снимает отметку о загрузке (файл нужно загрузить заново)."""
+        self.received.pop(part_name, None)
+        self.volumes.pop(part_name, None)
+        self.hashes.pop(part_name, None)
+        self.extra.discard(part_name)
+        if part_name in self.index:
+            self._missing[part_name] = None
+
+    @property
+    def missing_count(self) -> int:
+        return len(self._missing)
+
+    def missing(self, limit: int = None) -> list:
+        return list(islice(self._missing, limit))
+
+    def to_state(self) -> dict:
+        return {
+            'order': {
+                'order_id': self.order_id,
+                'items': [[item.name, item.count, item.material] for item in self.items],
+            },
+            'received': self.received,
+            'received_version': self.received_version,
+            'volumes': self.volumes,
+            'hashes': self.hashes,
+        }
+
+    @classmethod
+    def from_state(cls, data: dict):
+        raw = data.get('order')
+        if raw is None:
+            return None
+        order = cls([OrderItem(*item) for item in raw['items']], raw['order_id'])
+        for part_name, file_name in data.get('received', {}).items():
+            order.receive(part_name, file_name)
+        order.received_version = data.get('received_version', 0)
+        order.volumes = dict(data.get('volumes', {}))
+        order.hashes = dict(data.get('hashes', {}))
+        return order
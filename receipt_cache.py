@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import config
+from order import Order, MATERIALS, COMPARE_MATERIALS
+from sqlite_cache import SQLiteCache
+
+
+CACHE_PATH = os.path.join('data', 'receipt_cache.sqlite')
+MAX_ENTRIES = 2000
+
+
+def receipt_key(order: Order, today: str = None):
+    """
+    Ключ кэша чеков: хэш всего, что попадает в PDF, - содержимого файлов
+    деталей и их расчётных объёмов (зависят от настроек оценки печати),
+    количеств и материалов, цен, реквизитов и даты печати.
+
+    Возвращает:
+        str: hex-строка sha256 или None, если хэши есть не у всех деталей.
+    """
+    if any(item.name not in order.hashes for item in order.items):
+        return None
+    payload = {
+        'items': [[order.hashes[item.name], order.volumes.get(item.name), item.name, item.count, item.material]
+                  for item in order.items],
+        'materials': MATERIALS,
+        'compare': COMPARE_MATERIALS,
+        'customer': config.customer,
+        'executor': config.executor,
+        'date': today or datetime.now().strftime("%d.%m.%Y"),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+class ReceiptCache(SQLiteCache):
+    """
+    Постоянный кэш готовых чеков в SQLite.
+
+    Ключ - хэш содержимого заказа (см. receipt_key):
+    хэши файлов деталей, количества, материалы и цены, реквизиты и дата.
+    Хранится сам PDF и file_id, под которым Telegram его уже принял, -
+    повторный чек отправляется по file_id без сборки и без загрузки файла.
+    Вытеснение по LRU (см. sqlite_cache.SQLiteCache).
+    """
+
+    table = 'receipts'
+    columns = ("file_id TEXT", "pdf BLOB NOT NULL")
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        super().__init__(path, max_entries)
+
+    def get(self, key: str):
+        """Возвращает (file_id или None, содержимое PDF) или None, если записи нет."""
+        row = self._get(key)
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def put(self, key: str, pdf: bytes, file_id: str = None) -> None:
+        self._put(key, file_id, pdf)
+
+
+def get_cache() -> ReceiptCache:
+    """Кэш по умолчанию (один на процесс), создаётся при первом обращении."""
+    return ReceiptCache.default()
@@ -4,73 +4,229 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from datetime import datetime
+import io
 import os
-import math
+import threading
+import time
+import uuid
+
+import numpy as np
 
 import config
 import weight_from_stl
+import stl_store
+from order import Order, MATERIALS, COMPARE_MATERIALS
 
 
-class Receipt:
-    def __init__(self):
-        self.doc = SimpleDocTemplate("./data/reports/output2.pdf", pagesize=A4)
-        self.styles = getSampleStyleSheet()
+FONT_NAME = 'ArialUnicode'
+# Шрифт с кириллицей: путь из config.FONT_PATH, иначе первый найденный
+# системный, иначе любой .ttf из папки fonts рядом с ботом
+FONT_PATH = getattr(config, 'FONT_PATH', None)
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+SYSTEM_FONTS = [
+    "C:/Windows/Fonts/arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+]
+REPORTS_DIR = os.path.join('data', 'reports')
 
-        font_path = "C:/Windows/Fonts/arial.ttf"
-        pdfmetrics.registerFont(TTFont('ArialUnicode', font_path))
+# Большие заказы: с LARGE_ORDER_ROWS строк таблица режется на куски по странице,
+# с CANVAS_ORDER_ROWS (None - никогда) чек рисуется прямо на canvas без platypus
+LARGE_ORDER_ROWS = getattr(config, 'LARGE_ORDER_ROWS', 300)
+CANVAS_ORDER_ROWS = getattr(config, 'CANVAS_ORDER_ROWS', None)
 
-        self.custom_styles = {}
+# Ширины колонок основной таблицы и высота строки текста (шрифт 10 + отступы ячейки)
+COL_WIDTHS = [150, 80, 60, 60, 50, 50]
+COMPARE_COL_WIDTHS = [100, 80, 80]
+LINE_HEIGHT = 12
+CELL_PADDING = 6
+MARGIN = 72  # поля страницы, как у SimpleDocTemplate по умолчанию
 
-        self.story = []
+# Базовое оформление таблицы, общее для всех чеков
+BASE_TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+    ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, -1), FONT_NAME),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+]
+
+# Стиль кусков большой таблицы - один объект на все куски и все чеки
+CHUNK_TABLE_STYLE = TableStyle(BASE_TABLE_STYLE)
+
+_init_lock = threading.Lock()
+_custom_styles = None
+
+
+def find_font_path() -> str:
+    """Путь к TTF-шрифту чека (см. FONT_PATH, SYSTEM_FONTS, FONTS_DIR)."""
+    bundled = []
+    if os.path.isdir(FONTS_DIR):
+        bundled = sorted(os.path.join(FONTS_DIR, f) for f in os.listdir(FONTS_DIR) if f.lower().endswith('.ttf'))
+    for path in ([FONT_PATH] if FONT_PATH else []) + SYSTEM_FONTS + bundled:
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(
+        f"Не найден TTF-шрифт с кириллицей: укажите FONT_PATH в config.py или положите .ttf в {FONTS_DIR}"
+    )
 
-        self.init_styles()
+
+def get_custom_styles() -> dict:
+    """
+    Регистрирует шрифт и собирает стили абзацев один раз на процесс:
+    TTF разбирается только при первом чеке (или при прогреве воркера, см. tasks.warm_up).
+    Стили только читаются, поэтому их можно делить между чеками и потоками.
+    """
+    global _custom_styles
+    if _custom_styles is not None:
+        return _custom_styles
+
+    with _init_lock:
+        if _custom_styles is None:
+            pdfmetrics.registerFont(TTFont(FONT_NAME, find_font_path()))
+            styles = getSampleStyleSheet()
+            _custom_styles = {
+                "title_style": ParagraphStyle(
+                    'CustomTitle',
+                    parent=styles['Title'],
+                    fontName=FONT_NAME,
+                    fontSize=18,
+                    spaceAfter=14
+                ),
+                "normal_style": ParagraphStyle(
+                    'CustomNormal',
+                    parent=styles['Normal'],
+                    fontName=FONT_NAME,
+                    fontSize=12,
+                    spaceAfter=12
+                ),
+                "sign_style": ParagraphStyle(
+                    'CustomItalic',
+                    parent=styles['Italic'],
+                    fontName=FONT_NAME,
+                    fontSize=12,
+                    spaceAfter=5
+                ),
+                "bold_style": ParagraphStyle(
+                    'Customh3',
+                    parent=styles['h3'],
+                    fontName=FONT_NAME,
+                    fontSize=14,
+                    spaceAfter=12
+                ),
+            }
+    return _custom_styles
+
+
+def unique_report_path() -> str:
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    return os.path.join(REPORTS_DIR, f"receipt_{uuid.uuid4().hex}.pdf")
+
+
+class Receipt:
+    def __init__(self, output=None):
+        """
+        Параметры:
+            output: путь к PDF или файлоподобный объект (например, BytesIO).
+                    По умолчанию - уникальный файл в data/reports.
+        """
+        if output is None:
+            output = unique_report_path()
+        self.output = output
+        self.doc = SimpleDocTemplate(output, pagesize=A4)
+
+        self.custom_styles = get_custom_styles()
+
+        self.story = []
 
         self.table = None
         self.table_data = []
         self.table_pref = []
         self.parsed_text = [
-            ["d1", "3"],
-            ["d2", "3"],
-            ["d3", "4"],
-            ["d4", "3"],
-            ["d5", "5"],
-            ["d6", "10"],
-            ["d7", "3"],
-            ["d8", "1"]
-        ]
-        self.parts_materials = [
-            "PETG",
-            "PLA"
+            ["d1", 3, "PETG"],
+            ["d2", 3, "PETG"],
+            ["d3", 4, "PETG"],
+            ["d4", 3, "PLA"],
+            ["d5", 5, "PETG"],
+            ["d6", 10, "PETG"],
+            ["d7", 3, "PETG"],
+            ["d8", 1, "PETG"]
         ]
-        self.material_price = {
-            "PETG": 2,
-            "PLA": 5
-        }
+        self.materials = MATERIALS
+        self.compare_materials = COMPARE_MATERIALS
+        self.large_order_rows = LARGE_ORDER_ROWS
+        self.canvas_order_rows = CANVAS_ORDER_ROWS
+        self.volumes = {}
+        self.hashes = {}  # деталь -> хэш файла в stl_store
         self.final_sum: int = 0
+        self.material_totals = {}  # материал -> сумма заказа в нём
+        self.timings = {}  # стадия -> секунды последней сборки
 
     def set_table_preferences(self):
-        self.table_pref = [
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, -1), 'ArialUnicode'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ] + self.table_pref
-
-        self.table.setStyle(TableStyle(self.table_pref))
-
-    def set_data(self, text: str) -> None:
-        lines = text.split("\n")
-        self.parsed_text = []
-        for line in lines:
-            splited = line.split()
-            name, num = ' '.join(splited[0:-1]), int(splited[-1])
-            self.parsed_text.append([name, int(num)])
-        print(self.parsed_text)
+        self.table.setStyle(TableStyle(BASE_TABLE_STYLE + self.table_pref))
+
+    def set_order(self, order: Order) -> None:
+        """
+        Параметры:
+            order: разобранный заказ (см. order.Order). Уже посчитанные объёмы
+                   деталей берутся из order.volumes; для деталей без объёма
+                   он считается по файлу из stl_store (или data/stl/<имя>.stl).
+        """
+        self.parsed_text = [[item.name, item.count, item.material] for item in order.items]
+        self.volumes = order.volumes
+        self.hashes = order.hashes
+
+    def set_data(self, text: str, volumes: dict = None) -> None:
+        """
+        Параметры:
+            text: текст заказа ("имя количество [материал]" по строкам).
+            volumes: заранее посчитанные объёмы деталей {имя: см³}.
+        """
+        order = Order.parse(text)
+        if order is None:
+            raise ValueError(f"Неверный формат заказа: {text!r}")
+        order.volumes = volumes or {}
+        self.set_order(order)
+
+    def price_matrix(self):
+        """
+        Массы и стоимости всех строк заказа сразу во всех материалах -
+        одна операция NumPy по объёмам, без повторных проходов по мешам.
+
+        Возвращает:
+            tuple: (названия материалов, массы 1 шт. [строки x материалы],
+                    стоимости строк [строки x материалы])
+        """
+        names = list(self.materials)
+        densities = np.array([self.materials[m]["density"] for m in names], dtype=np.float64)
+        prices = np.array([self.materials[m]["price"] for m in names], dtype=np.float64)
+
+        volumes = np.empty(len(self.parsed_text), dtype=np.float64)
+        counts = np.empty(len(self.parsed_text), dtype=np.float64)
+        for i, (name, count, _) in enumerate(self.parsed_text):
+            volume = self.volumes.get(name)
+            if volume is None:
+                file_hash = self.hashes.get(name)
+                if file_hash:
+                    file_path = stl_store.get_store().path(file_hash)
+                else:
+                    file_path = os.path.join('data', 'stl', name + ".stl")
+                volume = weight_from_stl.calculate_print_volume_cached(file_path)
+            volumes[i] = volume
+            counts[i] = count
+
+        masses = np.round(np.outer(volumes, densities), 2)
+        costs = np.ceil(masses * counts[:, None] * prices[None, :])
+        return names, masses, costs
 
 
     def generate_table(self):
@@ -82,14 +238,14 @@ class Receipt:
              "Цена,\nр.", ],
         ]
 
+        names, masses, costs = self.price_matrix()
+        self.material_totals = dict(zip(names, costs.sum(axis=0).astype(int).tolist()))
+
         for i in range(len(self.parsed_text)):
-            filename = self.parsed_text[i][0] + ".stl"
-            file_path = os.path.join('data', 'stl', filename)
-            model_weight = round(weight_from_stl.calculate_mass_from_stl(
-                file_path,
-                1.3
-            ), 2)
-            price = math.ceil(model_weight * self.parsed_text[i][1] * self.material_price['PETG'])
+            material = self.parsed_text[i][2]
+            column = names.index(material)
+            model_weight = float(masses[i, column])
+            price = int(costs[i, column])
 
             plit_size = 25
             name_size = len(self.parsed_text[i][0])
@@ -102,9 +258,9 @@ class Receipt:
             self.table_data.append(
                 [reformed_name,
                  self.parsed_text[i][1],
-                 self.parts_materials[0], # пока только PETG
+                 material,
                  model_weight,
-                 self.material_price[self.parts_materials[0]], # пока только PETG
+                 self.materials[material]["price"],
                  price
                  ]
             )
@@ -140,19 +296,190 @@ class Receipt:
         #     start_pos = end_pos
 
 
+    @staticmethod
+    def row_height(row) -> float:
+        """Высота строки таблицы по числу строк текста в самой высокой ячейке."""
+        lines = max(str(cell).count("\n") for cell in row) + 1
+        return lines * LINE_HEIGHT + CELL_PADDING
+
+    def chunked_tables(self, first_page_used: float = 0.0) -> list:
+        """
+        Таблица большого заказа кусками по странице: у каждого куска своя
+        шапка, ширины колонок и высоты строк заданы заранее, так что platypus
+        не измеряет ячейки и не режет огромную таблицу целиком.
+
+        Параметры:
+            first_page_used: сколько места на первой странице уже занято (заголовком).
+        """
+        header = self.table_data[0]
+        header_height = self.row_height(header)
+        # Высота рамки SimpleDocTemplate без её внутренних отступов (6 сверху и снизу)
+        page_height = self.doc.height - 12 - header_height
+
+        tables = []
+        rows, heights, used = [header], [header_height], first_page_used
+        for row in self.table_data[1:]:
+            height = self.row_height(row)
+            if used + height > page_height and len(rows) > 1:
+                tables.append(Table(rows, colWidths=COL_WIDTHS, rowHeights=heights, repeatRows=1,
+                                    style=CHUNK_TABLE_STYLE))
+                rows, heights, used = [header], [header_height], 0.0
+            rows.append(row)
+            heights.append(height)
+            used += height
+        tables.append(Table(rows, colWidths=COL_WIDTHS, rowHeights=heights, repeatRows=1,
+                            style=CHUNK_TABLE_STYLE))
+        return tables
+
+    def draw_canvas(self) -> None:
+        """
+        Чек огромного заказа прямо на canvas: строки рисуются по одной и
+        страницы закрываются по мере заполнения, время и память линейны
+        по числу строк. Сетка таблицы рисуется одной командой на страницу,
+        а не прямоугольником на каждую ячейку. Оформление то же, что у platypus.
+        """
+        styles = self.custom_styles
+        width, height = A4
+        c = canvas.Canvas(self.output, pagesize=A4)
+        y = height - MARGIN
+        grid = []  # линии сетки текущего куска таблицы на странице
+        segment = None  # (верх куска, ширины колонок)
+        header_cells = None
+
+        def flush_grid():
+            nonlocal segment
+            if segment is not None:
+                top, widths = segment
+                x = (width - sum(widths)) / 2
+                for col_width in [0] + widths:
+                    x += col_width
+                    grid.append((x, top, x, y))
+                c.lines(grid)
+                grid.clear()
+                segment = None
+
+        def new_page():
+            nonlocal y
+            flush_grid()
+            c.showPage()
+            y = height - MARGIN
+
+        def text(line, style, x=None):
+            nonlocal y
+            flush_grid()
+            line_height = style.fontSize + style.spaceAfter
+            if y - line_height < MARGIN:
+                new_page()
+            y -= line_height
+            c.setFont(FONT_NAME, style.fontSize)
+            if x is None:
+                c.drawCentredString(width / 2, y, line)
+            else:
+                c.drawString(x, y, line)
+
+        def row(cells, widths, is_header=False):
+            nonlocal y, segment
+            row_height = self.row_height(cells)
+            if y - row_height < MARGIN:
+                new_page()
+                if not is_header:
+                    row(header_cells, widths, is_header=True)
+            left = (width - sum(widths)) / 2
+            if segment is None:
+                segment = (y, widths)
+                grid.append((left, y, left + sum(widths), y))
+            y -= row_height
+            grid.append((left, y, left + sum(widths), y))
+            if is_header:
+                c.setFillColor(colors.lightgrey)
+                c.rect(left, y, sum(widths), row_height, stroke=0, fill=1)
+                c.setFillColor(colors.black)
+            c.setFont(FONT_NAME, 10)
+            x = left
+            for i, (cell, col_width) in enumerate(zip(cells, widths)):
+                lines = str(cell).split("\n")
+                # Текст по центру ячейки по вертикали, как VALIGN MIDDLE
+                line_y = y + row_height / 2 + (len(lines) - 1) * LINE_HEIGHT / 2 - 3.5
+                for line in lines:
+                    if i == 0:
+                        c.drawString(x + CELL_PADDING, line_y, line)
+                    else:
+                        c.drawCentredString(x + col_width / 2, line_y, line)
+                    line_y -= LINE_HEIGHT
+                x += col_width
+
+        text("Уведомление об оплате услуги", styles["title_style"])
+        text("№ 000.000.000", styles["title_style"])
+
+        header_cells = self.table_data[0]
+        row(header_cells, COL_WIDTHS, is_header=True)
+        for cells in self.table_data[1:]:
+            row(cells, COL_WIDTHS)
+
+        text(f"К оплате: {self.final_sum} руб.", styles["bold_style"], MARGIN)
+
+        if self.compare_materials:
+            text("Стоимость заказа в других материалах", styles["normal_style"], MARGIN)
+            header_cells = ["Материал", "Цена\nза грамм,\nр/г", "Сумма,\nр."]
+            row(header_cells, COMPARE_COL_WIDTHS, is_header=True)
+            for name, total in self.material_totals.items():
+                row([name, self.materials[name]["price"], total], COMPARE_COL_WIDTHS)
+        y -= 20
+
+        today = datetime.now().strftime("%d.%m.%Y")
+        text(f"Исполнитель: {config.executor}", styles["sign_style"], MARGIN)
+        text(f"Заказчик: {config.customer}", styles["sign_style"], MARGIN)
+        text(f"Дата печати: {today}", styles["sign_style"], MARGIN)
+        flush_grid()
+        c.save()
+
     def generate_report(self):
+        # Чек можно собирать повторно - начинаем с чистого состояния
+        self.story = []
+        self.table_pref = []
+        self.final_sum = 0
+        self.timings = {}
+
+        # Таблица
+        start = time.perf_counter()
+        self.generate_table()
+        self.timings['generate_table'] = time.perf_counter() - start
+        rows = len(self.table_data) - 1
+
+        # Огромный заказ - сразу на canvas
+        if self.canvas_order_rows is not None and rows > self.canvas_order_rows:
+            start = time.perf_counter()
+            self.draw_canvas()
+            self.timings['canvas_build'] = time.perf_counter() - start
+            return
+
         # Заголовок
         self.story.append(Paragraph("Уведомление об оплате услуги", self.custom_styles["title_style"]))
         self.story.append(Paragraph("№ 000.000.000", self.custom_styles["title_style"]))
 
-        # Таблица
-        self.generate_table()
-        self.table = Table(self.table_data, colWidths=[150, 80, 60, 60, 50])
-        self.set_table_preferences()
-        self.story.append(self.table)
+        if rows > self.large_order_rows:
+            title_height = sum(
+                p.wrap(self.doc.width, self.doc.height)[1] + p.getSpaceAfter() for p in self.story
+            )
+            self.story.extend(self.chunked_tables(title_height))
+        else:
+            self.table = Table(self.table_data, colWidths=COL_WIDTHS)
+            self.set_table_preferences()
+            self.story.append(self.table)
 
         # Итог
         self.story.append(Paragraph(f"К оплате: {self.final_sum} руб.",  self.custom_styles["bold_style"]))
+
+        # Сравнение материалов
+        if self.compare_materials:
+            self.story.append(Paragraph("Стоимость заказа в других материалах", self.custom_styles["normal_style"]))
+            comparison = Table(
+                [["Материал", "Цена\nза грамм,\nр/г", "Сумма,\nр."]] +
+                [[name, self.materials[name]["price"], total] for name, total in self.material_totals.items()],
+                colWidths=COMPARE_COL_WIDTHS
+            )
+            comparison.setStyle(TableStyle(BASE_TABLE_STYLE))
+            self.story.append(comparison)
         self.story.append(Spacer(1, 20))
 
         # Подписи
@@ -163,38 +490,27 @@ class Receipt:
         self.story.append(KeepTogether([executor, customer, date]))
 
         # Сбор в PDF
+        start = time.perf_counter()
         self.doc.build(self.story)
+        self.timings['doc_build'] = time.perf_counter() - start
+
 
-    def init_styles(self):
-        self.custom_styles["title_style"] = ParagraphStyle(
-            'CustomTitle',
-            parent=self.styles['Title'],
-            fontName='ArialUnicode',
-            fontSize=18,
-            spaceAfter=14
-        )
-        self.custom_styles["normal_style"] = ParagraphStyle(
-            'CustomNormal',
-            parent=self.styles['Normal'],
-            fontName='ArialUnicode',
-            fontSize=12,
-            spaceAfter=12
-        )
-        self.custom_styles["sign_style"] = ParagraphStyle(
-            'CustomItalic',
-            parent=self.styles['Italic'],
-            fontName='ArialUnicode',
-            fontSize=12,
-            spaceAfter=5
-        )
-        self.custom_styles["bold_style"] = ParagraphStyle(
-            'Customh3',
-            parent=self.styles['h3'],
-            fontName='ArialUnicode',
-            fontSize=14,
-            spaceAfter=12
-        )
+def build_report(order) -> tuple:
+    """
+    Строит PDF по заказу в отдельном экземпляре Receipt.
+    Вызывается в процессе-воркере (см. bot.py), поэтому принимает и
+    возвращает только простые данные: order - Order или его to_state().
 
+    Возвращает:
+        tuple: (содержимое PDF, {стадия: секунды})
+    """
+    if not isinstance(order, Order):
+        order = Order.from_state(order)
+    buffer = io.BytesIO()
+    receipt = Receipt(buffer)
+    receipt.set_order(order)
+    receipt.generate_report()
+    return buffer.getvalue(), receipt.timings
 
 if __name__ == "__main__":
     receipt = Receipt()
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from collections import deque
+
+
+# Оценка длительности задачи до первых замеров, секунды
+DEFAULT_JOB_SECONDS = 2.0
+
+
+class QueueFull(Exception):
+    """У пользователя уже слишком много задач этого вида в очереди."""
+
+
+class JobCancelled(Exception):
+    """Задача отменена (заказ сброшен)."""
+
+
+class Job:
+    __slots__ = ('user_id', 'chat_id', 'kind', 'func', 'args', 'future', 'task', 'on_queue', 'enqueued')
+
+    def __init__(self, user_id, chat_id, kind, func, args, on_queue):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        self.on_queue = on_queue
+        self.enqueued = time.monotonic()
+
+
+class JobScheduler:
+    """
+    Очередь тяжёлых задач (расчёт мешей, сборка PDF) перед пулом процессов.
+
+    Одновременно выполняется не больше max_concurrent задач. Очередь у каждого
+    пользователя своя, а задачи выбираются по кругу между пользователями,
+    поэтому десять больших заказов одного клиента не задерживают остальных.
+    limits ограничивает число задач вида на пользователя (например, чеков),
+    лишние отклоняются с QueueFull. Ожидающим задачам с on_queue сообщаются
+    позиция в очереди и примерное время ожидания.
+
+    Отмена не прерывает уже запущенную задачу: работу в пуле процессов
+    нельзя остановить на середине. Ожидающий сразу получает JobCancelled,
+    а слот занят, пока задача не закончится, - иначе в пуле выполнялось бы
+    больше max_concurrent задач.
+    """
+
+    def __init__(self, max_concurrent: int, limits: dict = None):
+        self.max_concurrent = max_concurrent
+        self.limits = limits or {}
+        self.running = set()
+        self._queues = {}  # user_id -> deque(Job)
+        self._ring = deque()  # пользователи с задачами в очереди, в порядке обхода
+        self._average = DEFAULT_JOB_SECONDS  # скользящее среднее длительности задачи
+        self._watched = set()  # ожидающие задачи с on_queue
+
+    async def run(self, user_id, chat_id, kind: str, func, *args, on_queue=None):
+        """
+        Ставит задачу в очередь и ждёт результата. func(*args) вызывается,
+        когда подходит очередь, и должна вернуть awaitable.
+        on_queue(позиция, секунды) вызывается, пока задача ждёт.
+        """
+        limit = self.limits.get(kind)
+        if limit is not None and self.count(user_id=user_id, kind=kind) >= limit:
+            raise QueueFull(kind)
+
+        job = Job(user_id, chat_id, kind, func, args, on_queue)
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._ring.append(user_id)
+        queue.append(job)
+        if on_queue is not None:
+            self._watched.add(job)
+        self._dispatch()
+        if job.task is None:
+            self._notify()
+
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # Ожидающий отменён (например, close_order отменил расчёт объёма)
+            self._discard(job)
+            raise
+
+    def count(self, user_id=None, chat_id=None, kind: str = None) -> int:
+        """Число ожидающих и выполняющихся задач с заданными признаками."""
+        jobs = list(self.running)
+        for queue in ([self._queues.get(user_id, ())] if user_id is not None else self._queues.values()):
+            jobs.extend(queue)
+        return sum(
+            1 for job in jobs
+            if (user_id is None or job.user_id == user_id)
+            and (chat_id is None or job.chat_id == chat_id)
+            and (kind is None or job.kind == kind)
+        )
+
+    def cancel(self, chat_id) -> None:
+        """
+        Отменяет все задачи чата: ожидающие убираются из очереди, ожидающие
+        выполняющихся задач получают JobCancelled (сами задачи дорабатывают).
+        """
+        for user_id in list(self._queues):
+            for job in [job for job in self._queues[user_id] if job.chat_id == chat_id]:
+                self._discard(job)
+                if not job.future.done():
+                    job.future.set_exception(JobCancelled())
+        for job in self.running:
+            if job.chat_id == chat_id and not job.future.done():
+                job.future.set_exception(JobCancelled())
+
+    def _discard(self, job: Job) -> None:
+        self._watched.discard(job)
+        if job.task is not None:
+            return  # Уже выполняется: слот освободится, когда задача закончится
+        queue = self._queues.get(job.user_id)
+        if queue is None or job not in queue:
+            return
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.user_id]
+            self._ring.remove(job.user_id)
+        self._notify()
+
+    def _dispatch(self) -> None:
+        started = False
+        while self._ring and len(self.running) < self.max_concurrent:
+            user_id = self._ring.popleft()
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if queue:
+                self._ring.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._start(job)
+            started = True
+        if started:
+            self._notify()
+
+    def _start(self, job: Job) -> None:
+        self._watched.discard(job)
+        self.running.add(job)
+        started = time.monotonic()
+
+        async def execute():
+            return await job.func(*job.args)
+
+        def done(task):
+            self.running.discard(job)
+            error = None
+            if not task.cancelled():
+                self._average = 0.9 * self._average + 0.1 * (time.monotonic() - started)
+                error = task.exception()  # забираем, даже если результат уже никому не нужен
+            if not job.future.done():
+                if task.cancelled():
+                    job.future.set_exception(JobCancelled())
+                elif error is not None:
+                    job.future.set_exception(error)
+                else:
+                    job.future.set_result(task.result())
+            self._dispatch()
+
+        job.task = asyncio.create_task(execute())
+        job.task.add_done_callback(done)
+
+    def position(self, job: Job) -> tuple:
+        """
+        Позиция задачи (1 - следующая) и оценка ожидания в секундах
+        при обходе очередей пользователей по кругу.
+        """
+        index = self._queues[job.user_id].index(job)
+        ahead = 0
+        before = True
+        for user_id in self._ring:
+            if user_id == job.user_id:
+                before = False
+            # Из каждой очереди до нашей задачи успеет выйти index задач,
+            # из очередей, стоящих в круге раньше нашей, - ещё по одной
+            ahead += min(index + 1 if before else index, len(self._queues[user_id]))
+        wait = ahead * self._average / self.max_concurrent
+        if len(self.running) >= self.max_concurrent:
+            wait += self._average / 2  # выполняющиеся задачи в среднем наполовину готовы
+        return ahead + 1, wait
+
+    def _notify(self) -> None:
+        for job in list(self._watched):
+            job.on_queue(*self.position(job))
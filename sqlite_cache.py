@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+_default_lock = threading.Lock()
+
+
+class SQLiteCache:
+    """
+    Основа постоянных кэшей в SQLite (stl_cache.MassCache, receipt_cache.ReceiptCache):
+    одна таблица "ключ -> значение" с вытеснением по LRU - при превышении
+    max_entries удаляются давно не использованные записи.
+
+    Подкласс задаёт table, key_column и columns (колонки значения с типами),
+    а однократные изменения схемы из прежних версий делает в _migrate.
+    Соединение открывается в режиме WAL и ждёт блокировку до 30 с: кэш
+    читают и пишут несколько процессов бота и воркеры пула.
+    """
+
+    table = None
+    key_column = 'key'
+    columns = ()  # например ("file_id TEXT", "pdf BLOB NOT NULL")
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._names = ', '.join(column.split()[0] for column in self.columns)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            f" {self.key_column} TEXT PRIMARY KEY,"
+            f" {', '.join(self.columns)},"
+            f" last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        pass
+
+    def _get(self, key: str):
+        """Значения колонок записи (кортеж) или None; попадание обновляет last_access."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._names} FROM {self.table} WHERE {self.key_column} = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE {self.key_column} = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row
+
+    def _put(self, key: str, *values) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} ({self.key_column}, {self._names}, last_access)"
+                f" VALUES ({', '.join('?' * (len(values) + 2))})",
+                (key, *values, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Удаляем самые старые по last_access записи сверх лимита
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE rowid IN ("
+            f" SELECT rowid FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+            (count - self.max_entries,)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @classmethod
+    def default(cls):
+        """Кэш с настройками по умолчанию (один на процесс), создаётся при первом обращении."""
+        with _default_lock:
+            if '_default' not in cls.__dict__:
+                cls._default = cls()
+        return cls._default
@@ -0,0 +1,115 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+
+# Ограничения Telegram: ~1 сообщение в секунду в чат и ~30 в секунду на бота
+CHAT_INTERVAL = 1.0
+GLOBAL_INTERVAL = 1 / 30
+# Пауза после последнего события, чтобы пачка файлов дала одно обновление
+DEBOUNCE = 1.5
+
+
+class RateLimiter:
+    """Раздаёт слоты отправки с учётом лимитов на чат и на бота в целом."""
+
+    def __init__(self, chat_interval: float = CHAT_INTERVAL, global_interval: float = GLOBAL_INTERVAL):
+        self.chat_interval = chat_interval
+        self.global_interval = global_interval
+        self._global_next = 0.0
+        self._chat_next = {}
+
+    async def wait(self, chat_id) -> None:
+        now = asyncio.get_running_loop().time()
+        # Слот резервируется сразу, до ожидания - следующий вызов получит более поздний
+        slot = max(now, self._global_next, self._chat_next.get(chat_id, 0.0))
+        self._global_next = slot + self.global_interval
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def forget(self, chat_id) -> None:
+        self._chat_next.pop(chat_id, None)
+
+
+class StatusUpdater:
+    """
+    Одно статусное сообщение на заказ, которое редактируется на месте.
+
+    Обновления копятся в очереди чата: пока ждём паузу (debounce) и свободный
+    слот RateLimiter, новые вызовы update только заменяют текст, так что
+    отправляется лишь последний. Закончившиеся чаты удаляются через finish.
+    """
+
+    def __init__(self, bot, limiter: RateLimiter = None, debounce: float = DEBOUNCE):
+        self.bot = bot
+        self.limiter = limiter or RateLimiter()
+        self.debounce = debounce
+        self.message_ids = {}  # chat_id -> id статусного сообщения
+        self._pending = {}  # chat_id -> (text, kwargs, repost)
+        self._workers = {}  # chat_id -> asyncio.Task
+
+    def attach(self, chat_id, message_id) -> None:
+        """Запоминает уже отправленное сообщение как статусное."""
+        self.message_ids[chat_id] = message_id
+
+    def update(self, chat_id, text: str, delay: float = None, repost: bool = False, **kwargs) -> None:
+        """
+        Ставит новый текст статуса в очередь чата.
+        kwargs передаются в send_message/edit_message_text (reply_markup, parse_mode).
+        repost=True - удалить старое сообщение и отправить новое внизу чата.
+        """
+        previous = self._pending.get(chat_id)
+        self._pending[chat_id] = (text, kwargs, repost or (previous is not None and previous[2]))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(
+                self._run(chat_id, self.debounce if delay is None else delay)
+            )
+
+    async def _run(self, chat_id, delay: float) -> None:
+        try:
+            while chat_id in self._pending:
+                await asyncio.sleep(delay)
+                await self.limiter.wait(chat_id)
+                text, kwargs, repost = self._pending.pop(chat_id, (None, None, False))
+                if text is None:
+                    break
+                await self._send(chat_id, text, kwargs, repost)
+        finally:
+            self._workers.pop(chat_id, None)
+
+    async def _send(self, chat_id, text: str, kwargs: dict, repost: bool) -> None:
+        message_id = self.message_ids.get(chat_id)
+        for _ in range(3):
+            try:
+                if message_id and not repost:
+                    try:
+                        await self.bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+                        return
+                    except TelegramBadRequest as e:
+                        if 'not modified' in str(e):
+                            return
+                        # Сообщение удалено или слишком старое - отправим новое
+
+                if message_id and repost:
+                    try:
+                        await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                    except Exception:
+                        pass  # Сообщение могло быть удалено вручную
+                msg = await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.message_ids[chat_id] = msg.message_id
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+
+    def finish(self, chat_id):
+        """
+        Завершает работу с чатом: отменяет отложенные обновления и забывает чат.
+        Возвращает id статусного сообщения (или None).
+        """
+        self._pending.pop(chat_id, None)
+        worker = self._workers.pop(chat_id, None)
+        if worker is not None:
+            worker.cancel()
+        self.limiter.forget(chat_id)
+        return self.message_ids.pop(chat_id, None)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+
+from sqlite_cache import SQLiteCache
+
+
+CACHE_PATH = os.path.join('data', 'stl_cache.sqlite')
+MAX_ENTRIES = 10000
+
+
+def content_hash(source) -> str:
+    """
+    Считает sha256 от содержимого STL.
+
+    Параметры:
+        source: путь к файлу или bytes/bytearray/memoryview с содержимым.
+
+    Возвращает:
+        str: hex-строка хэша.
+    """
+    h = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        h.update(source)
+        return h.hexdigest()
+
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MassCache(SQLiteCache):
+    """
+    Постоянный кэш геометрии STL-моделей в SQLite (см. weight_from_stl.stl_geometry):
+    объём, площадь, габариты. Масса в любом материале получается из объёма.
+
+    Ключ - хэш содержимого файла, поэтому повторно присланная деталь
+    (даже под другим именем) не парсится заново. Вытеснение по LRU
+    (см. sqlite_cache.SQLiteCache).
+    """
+
+    table = 'geometry'
+    key_column = 'hash'
+    columns = ("data TEXT NOT NULL",)
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        super().__init__(path, max_entries)
+
+    def _migrate(self) -> None:
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            # Однократная миграция: таблица mass (объём и масса по хэшу и плотности) из прежних версий
+            self._conn.execute("DROP TABLE IF EXISTS mass")
+            self._conn.execute("PRAGMA user_version = 1")
+
+    def get_geometry(self, file_hash: str):
+        """Возвращает словарь геометрии (см. weight_from_stl.stl_geometry) или None."""
+        row = self._get(file_hash)
+        return None if row is None else json.loads(row[0])
+
+    def put_geometry(self, file_hash: str, geometry: dict) -> None:
+        self._put(file_hash, json.dumps(geometry))
+
+
+def get_cache() -> MassCache:
+    """Кэш по умолчанию (один на процесс), создаётся при первом обращении."""
+    return MassCache.default()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import config
+import stl_cache
+
+
+STORE_DIR = os.path.join('data', 'stl')
+# Предел размера хранилища; при превышении удаляются давно не использованные файлы
+MAX_BYTES = getattr(config, 'STL_STORE_MAX_MB', 2048) * 1024 * 1024
+# Ссылки заказов старше этого срока считаются брошенными (процесс бота упал,
+# не закрыв заказ) и не защищают файлы от вытеснения
+LINK_TTL_S = 24 * 3600
+
+
+class StlStore:
+    """
+    Хранилище STL по хэшу содержимого: data/stl/objects/ab/<sha256>.stl.
+
+    Одинаковые детали под разными именами и в разных заказах лежат на диске
+    один раз; повторная загрузка того же содержимого не пишет файл заново,
+    а объём берётся из stl_cache по тому же хэшу. Имена деталей заказа
+    связаны с хэшами таблицей links, поэтому одноимённые файлы разных
+    заказов не перезаписывают друг друга. Размер ограничен max_bytes,
+    вытеснение по LRU; файлы открытых заказов (есть ссылка моложе
+    LINK_TTL_S) не вытесняются. Закрытый заказ снимает ссылки через unlink.
+    """
+
+    def __init__(self, root: str = STORE_DIR, max_bytes: int = MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            " hash TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS objects_last_access ON objects (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS links ("
+            " order_id TEXT NOT NULL,"
+            " part_name TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " created REAL NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (order_id, part_name))"
+        )
+        # Таблица из старых версий без created: её ссылки сразу считаются брошенными
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(links)")}
+        if 'created' not in columns:
+            self._conn.execute("ALTER TABLE links ADD COLUMN created REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS links_hash ON links (hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS links_created ON links (created)")
+        self._conn.commit()
+
+    def path(self, file_hash: str) -> str:
+        return os.path.join(self.root, 'objects', file_hash[:2], file_hash + '.stl')
+
+    def put(self, source, file_hash: str = None) -> tuple:
+        """
+        Кладёт STL в хранилище.
+
+        Параметры:
+            source: содержимое (bytes) или путь к файлу. Файл переносится
+                    в хранилище, а не копируется.
+            file_hash: уже посчитанный хэш содержимого, если есть.
+
+        Возвращает:
+            tuple: (хэш, путь в хранилище, True - если такой файл уже был)
+        """
+        if file_hash is None:
+            file_hash = stl_cache.content_hash(source)
+        path = self.path(file_hash)
+
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM objects WHERE hash = ?", (file_hash,)).fetchone()
+            if row is not None and os.path.exists(path):
+                self._conn.execute("UPDATE objects SET last_access = ? WHERE hash = ?", (time.time(), file_hash))
+                self._conn.commit()
+                if not isinstance(source, (bytes, bytearray, memoryview)):
+                    os.remove(source)
+                return file_hash, path, True
+
+        # Запись во временный файл рядом и атомарная замена: другой процесс
+        # бота не увидит недописанный файл
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(source)
+            os.replace(tmp_path, path)
+        else:
+            shutil.move(source, path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO objects (hash, size, last_access) VALUES (?, ?, ?)",
+                (file_hash, os.path.getsize(path), time.time())
+            )
+            self._evict(keep=file_hash)
+            self._conn.commit()
+        return file_hash, path, False
+
+    def link(self, order_id: str, part_name: str, file_hash: str) -> None:
+        """Связывает деталь открытого заказа с содержимым: пока связь есть, файл не вытесняется."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO links (order_id, part_name, hash, created) VALUES (?, ?, ?, ?)",
+                (order_id, part_name, file_hash, time.time())
+            )
+            self._conn.commit()
+
+    def unlink(self, order_id: str) -> None:
+        """Снимает связи закрытого заказа: его файлы снова можно вытеснять."""
+        with self._lock:
+            self._conn.execute("DELETE FROM links WHERE order_id = ?", (order_id,))
+            self._conn.commit()
+
+    def _evict(self, keep: str) -> None:
+        # Брошенные связи не держат файлы и не копятся в таблице
+        self._conn.execute("DELETE FROM links WHERE created < ?", (time.time() - LINK_TTL_S,))
+        # Удаляем самые старые по last_access файлы, пока не уложимся в предел;
+        # файлы открытых заказов не трогаем, даже если предел из-за них превышен
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT hash, size FROM objects WHERE hash != ? AND hash NOT IN (SELECT hash FROM links)"
+            " ORDER BY last_access ASC", (keep,)
+        )
+        evicted = []
+        for file_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append(file_hash)
+            total -= size
+        for file_hash in evicted:
+            try:
+                os.remove(self.path(file_hash))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM objects WHERE hash = ?", (file_hash,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        return {'objects': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = None
+
+
+def get_store() -> StlStore:
+    """Хранилище по умолчанию (одно на процесс), создаётся при первом обращении."""
+    global _default_store
+    if _default_store is None:
+        _default_store = StlStore()
+    return _default_store
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from typing import Any, Callable, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+
+
+STORAGE_PATH = os.path.join('data', 'fsm.sqlite')
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в SQLite: заказы переживают перезапуск бота,
+    а несколько процессов на одной машине видят одно и то же состояние
+    (WAL-режим, update_data и transform_data выполняются одной транзакцией).
+    Запросы идут в потоке (asyncio.to_thread): ожидание блокировки базы
+    другим процессом не останавливает event loop.
+    """
+
+    def __init__(self, path: str = STORAGE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT NOT NULL DEFAULT '{}')"
+        )
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _read_data(self, key: str) -> dict:
+        row = self._conn.execute("SELECT data FROM fsm WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _write_data(self, key: str, data: Mapping[str, Any]) -> None:
+        self._conn.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (key, json.dumps(dict(data), ensure_ascii=False))
+        )
+
+    def _set_state(self, key: StorageKey, state) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+                (self._key(key), state)
+            )
+
+    def _get_state(self, key: StorageKey):
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return row[0] if row else None
+
+    def _set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        with self._lock:
+            self._write_data(self._key(key), data)
+
+    def _get_data(self, key: StorageKey) -> dict:
+        with self._lock:
+            return self._read_data(self._key(key))
+
+    def _transform(self, key: StorageKey, func: Callable[[dict], Optional[dict]]) -> Optional[dict]:
+        # Чтение и запись в одной транзакции, чтобы параллельные
+        # обработчики (в том числе из других процессов) не теряли изменения
+        with self._lock:
+            storage_key = self._key(key)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                data = func(self._read_data(storage_key))
+                if data is not None:
+                    self._write_data(storage_key, data)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return data
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        await asyncio.to_thread(self._set_state, key, state)
+
+    async def get_state(self, key: StorageKey):
+        return await asyncio.to_thread(self._get_state, key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await asyncio.to_thread(self._set_data, key, data)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return await asyncio.to_thread(self._get_data, key)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict:
+        current = await self.transform_data(key, lambda current: {**current, **data})
+        return current.copy()
+
+    async def transform_data(self, key: StorageKey, func: Callable[[dict], Optional[dict]]) -> Optional[dict]:
+        return await asyncio.to_thread(self._transform, key, func)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    def _close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+async def _redis_transform(storage, key: StorageKey, func) -> Optional[dict]:
+    # Оптимистичная транзакция: WATCH ключа данных, чтение, MULTI/EXEC.
+    # Если ключ успели изменить, redis-py повторяет всё с новыми данными
+    redis_key = storage.key_builder.build(key, "data")
+
+    async def transaction(pipe):
+        value = await pipe.get(redis_key)
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        data = func(storage.json_loads(value) if value else {})
+        if data is not None:
+            pipe.multi()
+            if data:
+                pipe.set(redis_key, storage.json_dumps(data), ex=storage.data_ttl)
+            else:
+                pipe.delete(redis_key)
+        return data
+
+    return await storage.redis.transaction(transaction, redis_key, value_from_callable=True)
+
+
+# Блокировки ключей для хранилищ без своей транзакции (MemoryStorage и т.п.)
+_key_locks = weakref.WeakValueDictionary()
+
+
+async def transform_data(storage: BaseStorage, key: StorageKey,
+                         func: Callable[[dict], Optional[dict]]) -> Optional[dict]:
+    """
+    Атомарно меняет данные FSM: func получает текущие данные (dict, можно
+    менять на месте) и возвращает новые или None, чтобы ничего не записывать.
+    В отличие от update_data, параллельные вызовы не затирают изменения
+    друг друга. func может быть вызвана повторно (Redis), поэтому должна
+    зависеть только от переданных данных.
+
+    Возвращает записанные данные или None.
+    """
+    if isinstance(storage, SQLiteStorage):
+        return await storage.transform_data(key, func)
+    if hasattr(storage, 'redis') and hasattr(storage, 'key_builder'):
+        return await _redis_transform(storage, key, func)
+
+    # Прочие хранилища живут в памяти одного процесса - хватает блокировки ключа
+    lock = _key_locks.get(key)
+    if lock is None:
+        lock = _key_locks[key] = asyncio.Lock()
+    async with lock:
+        data = func(await storage.get_data(key))
+        if data is not None:
+            await storage.set_data(key, data)
+        return data
+
+
+def create_storage() -> BaseStorage:
+    """
+    Хранилище по настройке FSM_STORAGE в config:
+        "memory" (по умолчанию) - в памяти процесса, как раньше;
+        "sqlite" - файл data/fsm.sqlite (FSM_SQLITE_PATH);
+        "redis" - RedisStorage aiogram по REDIS_URL (нужен пакет redis;
+                  подойдёт любой Redis-совместимый сервер).
+    """
+    kind = getattr(config, 'FSM_STORAGE', 'memory')
+    if kind == 'sqlite':
+        return SQLiteStorage(getattr(config, 'FSM_SQLITE_PATH', STORAGE_PATH))
+    if kind == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(getattr(config, 'REDIS_URL', 'redis://localhost:6379/0'))
+    if kind == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное FSM_STORAGE: {kind}")
@@ -0,0 +1,28 @@
+"""
+Точки входа задач пула процессов бота.
+
+Тяжёлые модули (NumPy, numpy-stl, reportlab) импортируются здесь лениво,
+уже в воркере, поэтому процесс бота стартует и начинает принимать
+сообщения без них. warm_up прогревает воркер заранее: импорт модулей и
+разбор шрифта чека происходят до первого заказа, а не во время него.
+"""
+
+
+def warm_up() -> None:
+    try:
+        import weight_from_stl  # noqa: F401
+        import receipt_generator
+        receipt_generator.get_custom_styles()
+    except Exception as e:
+        # Не ломаем пул: ошибка (например, нет шрифта) повторится в задаче и дойдёт до бота
+        print(f"Прогрев воркера не удался: {e!r}")
+
+
+def mass_job(*args):
+    from weight_from_stl import mass_job
+    return mass_job(*args)
+
+
+def build_report(order_state):
+    from receipt_generator import build_report
+    return build_report(order_state)
@@ -0,0 +1,23 @@
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Модулям нужен только config с необязательными настройками (всё через getattr)
+# и подписями чека; без своего config.py тесты идут с настройками по умолчанию
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = sys.modules['config'] = types.ModuleType('config')
+    config.executor = config.customer = ""
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Кэши и хранилища в data/ создаются во временной папке теста."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
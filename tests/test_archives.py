@@ -0,0 +1,43 @@
+import io
+import zipfile
+
+import pytest
+
+import archives
+from workspace import OrderWorkspace
+
+
+def make_zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_zip_members_are_stored_one_by_one():
+    data = make_zip({'a.stl': b'a' * 100, 'dir/b.stl': b'b' * 100, 'c.stl': b'c', 'notes.txt': b'x'})
+    workspace = OrderWorkspace('order')
+    events = []
+    destination = workspace.destination
+    workspace.destination = lambda name, size: events.append(('extract', name)) or destination(name, size)
+
+    def store(part_name, source):
+        events.append(('store', part_name))
+        return len(source)
+
+    extracted, skipped = archives.extract_stl_members(data, 'parts.zip', {'a', 'b'}, workspace, store)
+    assert extracted == [('a', 'a.stl', 100), ('b', 'b.stl', 100)]
+    assert sorted(skipped) == ['c.stl', 'notes.txt']
+    # Каждый файл уходит в store до распаковки следующего
+    assert events == [('extract', 'a.stl'), ('store', 'a'), ('extract', 'b.stl'), ('store', 'b')]
+
+
+def test_zip_total_unpacked_size_is_capped(monkeypatch):
+    monkeypatch.setattr(archives, 'MAX_TOTAL_SIZE', 150)
+    data = make_zip({'a.stl': b'a' * 100, 'b.stl': b'b' * 100})
+    stored = []
+    with pytest.raises(ValueError):
+        archives.extract_stl_members(data, 'parts.zip', {'a', 'b'}, OrderWorkspace('order'),
+                                     lambda part_name, source: stored.append(part_name))
+    assert stored == ['a']
@@ -0,0 +1,105 @@
+import math
+
+import pytest
+
+import main
+
+# Статистика в формате каждого слайсера
+PRUSA = b"""; filament used [mm] = 1234.56
+; filament used [cm3] = 2.97
+; filament used [g] = 3.72
+; filament cost = 0.09
+; total filament used [g] = 3.72
+; filament_diameter = 1.75
+; filament_density = 1.24
+"""
+ORCA = b"""; HEADER_BLOCK_START
+; generated by OrcaSlicer 2.1.1
+; total filament length [mm] : 1234.56
+; total filament weight [g] : 3.72
+; HEADER_BLOCK_END
+"""
+CURA = b""";FLAVOR:Marlin
+;TIME:1234
+;Filament used: 1.23456m
+;Layer height: 0.2
+"""
+MULTI_EXTRUDER = b"""; filament used [mm] = 500.00, 750.00
+; filament used [g] = 1.50, 2.25
+; filament cost = 0.04, 0.06
+; filament_diameter = 1.75,2.85
+"""
+
+CURA_WEIGHT = math.pi * (main.DEFAULT_FILAMENT_DIAMETER / 2) ** 2 * 1234.56 / 1000 * main.DEFAULT_FILAMENT_DENSITY
+
+CASES = {
+    'prusa': ('tail', PRUSA, 3.72, {'length_mm': 1234.56, 'cost': 0.09, 'diameter_mm': 1.75, 'density_g_cm3': 1.24}),
+    'orca': ('head', ORCA, 3.72, {'length_mm': 1234.56}),
+    'cura': ('head', CURA, CURA_WEIGHT, {'weight_g': None, 'length_mm': 1234.56}),
+    'multi_extruder': ('tail', MULTI_EXTRUDER, 3.75, {'length_mm': 1250.0, 'cost': 0.1, 'diameter_mm': 1.75}),
+}
+
+# Маленькие окна и блок, не кратный длине строки: комментарии попадают на стыки блоков
+WINDOW = 1024
+CHUNK = 1000
+MOVES = b"G1 X10.5 Y20.25 E0.0125\n"
+
+
+@pytest.fixture(autouse=True)
+def small_windows(monkeypatch):
+    monkeypatch.setattr(main, 'HEAD_WINDOW', WINDOW)
+    monkeypatch.setattr(main, 'TAIL_WINDOW', WINDOW)
+    monkeypatch.setattr(main, 'SCAN_CHUNK', CHUNK)
+
+
+def moves(size):
+    """Ровно size байт G-code, последняя строка - комментарий-добивка."""
+    data = MOVES * (size // len(MOVES) - 1)
+    return data + b";" + b"x" * (size - len(data) - 2) + b"\n"
+
+
+def write_gcode(path, where, stats):
+    """
+    where: 'head' / 'tail' - статистика в своём окне, как её пишет слайсер;
+           'middle' - вне обоих окон, находится только потоковым проходом;
+           строку с весом (длиной у Cura) режет граница блоков.
+    """
+    if where == 'head':
+        data = stats + moves(3 * WINDOW)
+    elif where == 'tail':
+        data = moves(3 * WINDOW) + stats
+    else:
+        split = max(stats.rfind(b"[g]"), stats.rfind(b"used:"))
+        data = moves(3 * CHUNK - split) + stats + moves(2 * WINDOW)
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('where', ['window', 'middle'])
+@pytest.mark.parametrize('case', CASES)
+def test_slicer_formats(workdir, monkeypatch, case, where):
+    window, stats, weight, expected = CASES[case]
+    if where == 'window':
+        path = write_gcode(workdir / f"{case}.gcode", window, stats)
+        # Пустой блок - потоковый проход сразу заканчивается, всё находят окна
+        monkeypatch.setattr(main, 'SCAN_CHUNK', 0)
+    else:
+        path = write_gcode(workdir / f"{case}.gcode", 'middle', stats)
+        with open(path, 'rb') as f:
+            data = f.read()
+        in_windows = dict.fromkeys(main.GCODE_PATTERNS)
+        main._search_window(data[:WINDOW] + data[-WINDOW:], in_windows)
+        assert set(in_windows.values()) == {None}
+
+    info = main.extract_filament_info(path)
+    for key, value in expected.items():
+        if value is None:
+            assert info[key] is None
+        else:
+            assert info[key] == pytest.approx(value)
+    assert main.extract_filament_weight(path) == pytest.approx(weight)
+
+
+def test_no_statistics(workdir):
+    path = write_gcode(workdir / "empty.gcode", 'middle', b"; generated by hand\n")
+    assert main.extract_filament_weight(path) is None
@@ -0,0 +1,35 @@
+from order import DEFAULT_MATERIAL, Order, split_order_line
+
+
+def test_parse_skips_blank_lines():
+    order = Order.parse("деталь 3\n\n   \nвторая деталь 1\n")
+    assert [(item.name, item.count) for item in order.items] == [("деталь", 3), ("вторая деталь", 1)]
+
+
+def test_parse_material_suffix():
+    order = Order.parse("корпус 2 pla\nкрышка 1")
+    assert [item.material for item in order.items] == ["PLA", DEFAULT_MATERIAL]
+
+
+def test_name_ending_in_non_material_word():
+    assert split_order_line("шестерня 20 зубьев 4") == ("шестерня 20 зубьев", 4, DEFAULT_MATERIAL)
+    assert split_order_line("кронштейн левый 2") == ("кронштейн левый", 2, DEFAULT_MATERIAL)
+    # Неизвестное слово после количества - не материал и не часть имени
+    assert split_order_line("кронштейн 2 дерево") is None
+
+
+def test_parse_rejects_bad_format():
+    assert Order.parse("") is None
+    assert Order.parse("\n\n") is None
+    assert Order.parse("деталь 2\nбез количества") is None
+
+
+def test_receive_and_state_round_trip():
+    order = Order.parse("a 1\nb 2")
+    assert order.receive("a", "a.stl")
+    assert not order.receive("лишняя", "лишняя.stl")
+    assert order.missing() == ["b"] and order.extra == {"лишняя"}
+
+    restored = Order.from_state(order.to_state())
+    assert restored.order_id == order.order_id
+    assert restored.missing() == ["b"] and restored.extra == {"лишняя"}
@@ -0,0 +1,13 @@
+from receipt_cache import ReceiptCache
+
+
+def test_receipt_round_trip_and_lru(workdir):
+    cache = ReceiptCache(str(workdir / 'receipts.sqlite'), max_entries=2)
+    cache.put('a', b'%PDF a', 'file_a')
+    cache.put('b', b'%PDF b')
+    assert cache.get('a') == ('file_a', b'%PDF a')  # 'a' свежее, вытесняется 'b'
+    cache.put('c', b'%PDF c', 'file_c')
+    assert cache.get('b') is None
+    assert cache.get('c') == ('file_c', b'%PDF c')
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 2}
+    cache.close()
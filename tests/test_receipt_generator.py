@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+import config
+import receipt_generator
+from order import MATERIALS
+from reportlab.pdfgen import canvas
+
+# Заказ в материале по умолчанию, сравнение - по семи материалам
+SEVEN_MATERIALS = dict(MATERIALS)
+SEVEN_MATERIALS.update({f"M{i}": {"density": 1.2, "price": 3} for i in range(7 - len(MATERIALS))})
+
+
+@pytest.fixture
+def drawn(monkeypatch):
+    """Высоты всех строк текста, нарисованных на canvas."""
+    monkeypatch.setattr(config, 'executor', "Исполнитель", raising=False)
+    monkeypatch.setattr(config, 'customer', "Заказчик", raising=False)
+    ys = []
+    for method in ('drawString', 'drawCentredString'):
+        original = getattr(canvas.Canvas, method)
+
+        def record(self, x, y, text, *args, _original=original, **kwargs):
+            ys.append((y, text))
+            return _original(self, x, y, text, *args, **kwargs)
+        monkeypatch.setattr(canvas.Canvas, method, record)
+    return ys
+
+
+@pytest.mark.parametrize('rows', range(20, 60))
+def test_canvas_text_respects_bottom_margin(drawn, rows):
+    # Таблица любой длины: низ чека и сравнение 7 материалов попадают на любую высоту страницы
+    receipt = receipt_generator.Receipt(io.BytesIO())
+    receipt.canvas_order_rows = 0
+    receipt.materials = SEVEN_MATERIALS
+    receipt.compare_materials = True
+    receipt.set_data("\n".join(f"d{i} 1" for i in range(rows)),
+                     volumes={f"d{i}": 1.0 for i in range(rows)})
+    receipt.generate_report()
+
+    assert any(text.startswith("Дата печати") for _, text in drawn)
+    low = [(y, text) for y, text in drawn if y < receipt_generator.MARGIN]
+    assert not low
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from scheduler import JobCancelled, JobScheduler, QueueFull
+
+
+def test_round_robin_between_users():
+    async def run():
+        jobs = JobScheduler(1)
+        order = []
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        async def work(name):
+            order.append(name)
+
+        first = asyncio.create_task(jobs.run('x', 0, 'volume', blocker))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(jobs.run(user, 1, 'volume', work, f"{user}{i}"))
+                   for user, count in (('a', 3), ('b', 2)) for i in range(count)]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *waiting)
+        assert order == ['a0', 'b0', 'a1', 'b1', 'a2']
+    asyncio.run(run())
+
+
+def test_queue_full_per_user_and_kind():
+    async def run():
+        jobs = JobScheduler(1, limits={'report': 1})
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        running = asyncio.create_task(jobs.run('a', 1, 'report', blocker))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await jobs.run('a', 1, 'report', blocker)
+        # Лимит - на пользователя и вид задачи
+        others = [asyncio.create_task(jobs.run('b', 2, 'report', blocker)),
+                  asyncio.create_task(jobs.run('a', 1, 'volume', blocker))]
+        await asyncio.sleep(0)
+        assert jobs.count(kind='report') == 2 and jobs.count(user_id='a') == 2
+        gate.set()
+        await asyncio.gather(running, *others)
+        assert jobs.count() == 0
+    asyncio.run(run())
+
+
+def test_cancelled_running_job_keeps_slot():
+    async def run():
+        jobs = JobScheduler(1)
+        gate = asyncio.Event()
+        started = []
+
+        async def slow():
+            await gate.wait()
+
+        async def work(name):
+            started.append(name)
+            return name
+
+        running = asyncio.create_task(jobs.run('a', 1, 'volume', slow))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(jobs.run('a', 1, 'volume', work, 'queued'))
+        other = asyncio.create_task(jobs.run('b', 2, 'volume', work, 'other'))
+        await asyncio.sleep(0)
+
+        jobs.cancel(1)
+        with pytest.raises(JobCancelled):
+            await running
+        with pytest.raises(JobCancelled):
+            await queued
+        # Отменённая задача ещё выполняется и держит единственный слот
+        await asyncio.sleep(0.01)
+        assert started == [] and len(jobs.running) == 1
+
+        gate.set()
+        assert await other == 'other'
+        assert started == ['other'] and not jobs.running
+    asyncio.run(run())
+
+
+def test_waiting_jobs_get_queue_position():
+    async def run():
+        jobs = JobScheduler(1)
+        gate = asyncio.Event()
+        positions = []
+
+        async def blocker():
+            await gate.wait()
+
+        async def work():
+            pass
+
+        first = asyncio.create_task(jobs.run('a', 1, 'report', blocker))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(jobs.run('b', 2, 'report', work,
+                                              on_queue=lambda position, wait: positions.append(position)))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, second)
+        assert positions and positions[0] == 1
+    asyncio.run(run())
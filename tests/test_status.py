@@ -0,0 +1,50 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from status import RateLimiter, StatusUpdater
+
+
+def make_updater():
+    bot = MagicMock()
+    bot.edit_message_text = AsyncMock()
+    bot.delete_message = AsyncMock()
+    bot.send_message = AsyncMock(return_value=MagicMock(message_id=2))
+    return bot, StatusUpdater(bot, RateLimiter(0, 0), debounce=0.01)
+
+
+def test_updates_are_coalesced():
+    async def run():
+        bot, status = make_updater()
+        status.attach(1, 1)
+        for i in range(5):
+            status.update(1, f"загружено {i}")
+        await asyncio.sleep(0.05)
+        bot.edit_message_text.assert_awaited_once_with(text="загружено 4", chat_id=1, message_id=1)
+        bot.send_message.assert_not_awaited()
+    asyncio.run(run())
+
+
+def test_repost_survives_coalescing():
+    async def run():
+        bot, status = make_updater()
+        status.attach(1, 1)
+        status.update(1, "вниз", repost=True)
+        status.update(1, "последний")
+        await asyncio.sleep(0.05)
+        bot.delete_message.assert_awaited_once_with(chat_id=1, message_id=1)
+        bot.send_message.assert_awaited_once_with(chat_id=1, text="последний")
+        bot.edit_message_text.assert_not_awaited()
+        assert status.message_ids[1] == 2
+    asyncio.run(run())
+
+
+def test_finish_drops_pending_update():
+    async def run():
+        bot, status = make_updater()
+        status.attach(1, 1)
+        status.update(1, "не успеет")
+        assert status.finish(1) == 1
+        await asyncio.sleep(0.05)
+        bot.edit_message_text.assert_not_awaited()
+        bot.send_message.assert_not_awaited()
+    asyncio.run(run())
@@ -0,0 +1,30 @@
+import sqlite3
+
+from stl_cache import MassCache
+
+
+def test_geometry_round_trip_and_lru(workdir):
+    cache = MassCache(str(workdir / 'cache.sqlite'), max_entries=2)
+    for i in range(3):
+        cache.put_geometry(f"h{i}", {'volume_mm3': float(i)})
+    assert cache.get_geometry('h0') is None
+    assert cache.get_geometry('h2') == {'volume_mm3': 2.0}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 2}
+    cache.close()
+
+
+def test_old_mass_table_dropped_once(workdir):
+    path = str(workdir / 'cache.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE mass (hash TEXT, density REAL, volume REAL)")
+    conn.commit()
+    conn.close()
+
+    MassCache(path).close()
+    conn = sqlite3.connect(path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'mass' not in tables
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    # Миграция записана: при следующих открытиях схема не трогается
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,20 @@
+import os
+
+from stl_store import StlStore
+
+
+def test_eviction_keeps_linked_files(workdir):
+    store = StlStore(str(workdir / 'stl'), max_bytes=2500)
+    linked, _, _ = store.put(b'a' * 1000)
+    store.link('order1', 'a', linked)
+    free, _, _ = store.put(b'b' * 1000)
+    store.put(b'c' * 1000)
+    assert os.path.exists(store.path(linked)), "вытеснен файл открытого заказа"
+    assert not os.path.exists(store.path(free))
+
+    # Закрытый заказ не копит связи, и его файлы снова вытесняются
+    store.unlink('order1')
+    assert store._conn.execute("SELECT COUNT(*) FROM links").fetchone()[0] == 0
+    store.put(b'd' * 1000)
+    assert not os.path.exists(store.path(linked))
+    store.close()
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import SQLiteStorage, transform_data
+
+
+class SlowStorage(MemoryStorage):
+    """Как у Redis: данные копируются через JSON, а между чтением и записью есть await."""
+
+    async def get_data(self, key):
+        data = json.loads(json.dumps(await super().get_data(key)))
+        await asyncio.sleep(0.001)
+        return data
+
+    async def set_data(self, key, data):
+        await asyncio.sleep(0.001)
+        await super().set_data(key, json.loads(json.dumps(data)))
+
+
+@pytest.mark.parametrize('make_storage', [SlowStorage, lambda: SQLiteStorage('fsm.sqlite')],
+                         ids=['yielding', 'sqlite'])
+def test_concurrent_transforms_keep_all_updates(make_storage):
+    async def run():
+        storage = make_storage()
+        key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+        async def add(i):
+            def update(data):
+                data.setdefault('volumes', {})[i] = i
+                return data
+            await transform_data(storage, key, update)
+        await asyncio.gather(*(add(str(i)) for i in range(20)))
+        volumes = (await storage.get_data(key))['volumes']
+        await storage.close()
+        assert len(volumes) == 20
+    asyncio.run(run())
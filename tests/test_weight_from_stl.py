@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import weight_from_stl
+from benchmark import sphere_triangles, write_ascii_stl, write_binary_stl
+
+
+@pytest.fixture
+def sphere(workdir):
+    path = str(workdir / 'sphere.stl')
+    write_binary_stl(path, sphere_triangles(1000))
+    geometry = weight_from_stl.stl_geometry(path, shells=False)
+    with open(path, 'rb') as f:
+        return path, f.read(), geometry['volume_mm3'], geometry['triangles']
+
+
+def test_binary_stl_with_solid_header(sphere, workdir):
+    """Бинарный STL с заголовком "solid ..." и мусором в конце не даёт нулевой объём."""
+    _, data, expected, count = sphere
+    padded = workdir / 'padded.stl'
+    padded.write_bytes(b'solid exported'.ljust(80, b' ') + data[80:] + b'\0' * 100)
+    for source in (str(padded), padded.read_bytes()):
+        geometry = weight_from_stl.stl_geometry(source, shells=False)
+        assert geometry['triangles'] == count and np.isclose(geometry['volume_mm3'], expected)
+
+
+def test_binary_stl_with_wrong_count_is_not_zero(sphere, workdir):
+    _, data, _, count = sphere
+    broken = workdir / 'broken.stl'
+    broken.write_bytes(b'solid exported'.ljust(80, b' ') + np.uint32(count + 5).tobytes() + data[84:])
+    try:
+        volume = weight_from_stl.calculate_volume_from_stl(str(broken))
+    except Exception:
+        return
+    assert volume != 0, "файл с неверным числом треугольников дал нулевой объём"
+
+
+def write_ascii(workdir, header='solid benchmark'):
+    path = workdir / 'sphere_ascii.stl'
+    write_ascii_stl(str(path), sphere_triangles(1000))
+    text = path.read_text()
+    path.write_text(header + text[text.index('\n'):])
+    return path
+
+
+def test_ascii_header_with_vertex_word(sphere, workdir):
+    _, _, expected, count = sphere
+    path = write_ascii(workdir, header='solid vertex bracket')
+    geometry = weight_from_stl.stl_geometry(str(path), shells=False)
+    assert geometry['triangles'] == count and np.isclose(geometry['volume_mm3'], expected, rtol=1e-5)
+
+
+def test_ascii_vertex_without_three_coordinates(workdir):
+    path = write_ascii(workdir)
+    lines = path.read_text().split('\n')
+    index = next(i for i, line in enumerate(lines) if line.strip().startswith('vertex'))
+    lines[index] = '  vertex 1.0 2.0'
+    path.write_text('\n'.join(lines))
+    with pytest.raises(ValueError):
+        weight_from_stl.stl_geometry(str(path), shells=False)
+
+
+def test_calculate_functions_match_geometry(sphere):
+    path, _, expected, _ = sphere
+    assert np.isclose(weight_from_stl.calculate_volume_from_stl(path), expected / 1000)
+    assert np.isclose(weight_from_stl.calculate_mass_from_stl(path, 1.3), expected / 1000 * 1.3)
+    assert np.isclose(weight_from_stl.calculate_print_volume_cached(path), expected / 1000)
@@ -1,34 +1,424 @@
+import io
+import os
+import re
+import time
+
 import numpy as np
 from stl import mesh
 import math
 
+import config
+import stl_cache
+
+
+# Оценка пластика при печати (print_volume): стенки и крышки толщиной
+# PRINT_WALL_MM сплошные, внутри заполнение PRINT_INFILL (доля 0..1).
+# PRINT_INFILL = None - деталь считается сплошной, как раньше.
+PRINT_WALL_MM = getattr(config, 'PRINT_WALL_MM', 1.2)
+PRINT_INFILL = getattr(config, 'PRINT_INFILL', None)
+# Область печати принтера (x, y, z) в мм для проверки габаритов; None - не проверять
+BED_SIZE_MM = getattr(config, 'BED_SIZE_MM', None)
+# Оболочки считаются сортировкой всех вершин (в 3-7 раз дольше объёма),
+# поэтому при загрузке деталей - только по COUNT_SHELLS и для мешей
+# не больше SHELLS_MAX_TRIANGLES
+COUNT_SHELLS = getattr(config, 'COUNT_SHELLS', False)
+SHELLS_MAX_TRIANGLES = getattr(config, 'SHELLS_MAX_TRIANGLES', 2_000_000)
+
+# Запись треугольника в бинарном STL: нормаль, три вершины, 2 байта атрибутов
+BINARY_STL_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('v0', '<f4', (3,)),
+    ('v1', '<f4', (3,)),
+    ('v2', '<f4', (3,)),
+    ('attr', '<u2'),
+])
+BINARY_HEADER_SIZE = 84  # 80 байт заголовка + uint32 число треугольников
+
+# Сколько треугольников обрабатывать за раз (~12 МБ на блок из файла)
+CHUNK_TRIANGLES = 1 << 18
+
+
+# Везде ниже stl_file_path - путь к файлу либо содержимое файла в памяти
+# (bytes/bytearray/memoryview), например только что скачанное из Telegram.
+def _is_buffer(stl_file_path) -> bool:
+    return isinstance(stl_file_path, (bytes, bytearray, memoryview))
+
+
+def _source_size(stl_file_path) -> int:
+    if _is_buffer(stl_file_path):
+        return len(stl_file_path)
+    return os.path.getsize(stl_file_path)
+
+
+def _read_head(stl_file_path, size: int) -> bytes:
+    if _is_buffer(stl_file_path):
+        return bytes(stl_file_path[:size])
+    with open(stl_file_path, 'rb') as f:
+        return f.read(size)
+
+
+def _header_count(stl_file_path):
+    """Число треугольников из заголовка бинарного STL (None, если файл короче заголовка)."""
+    if _source_size(stl_file_path) < BINARY_HEADER_SIZE:
+        return None
+    head = _read_head(stl_file_path, BINARY_HEADER_SIZE)
+    return int(np.frombuffer(head, dtype='<u4', offset=80)[0])
+
+
+def is_binary_stl(stl_file_path) -> bool:
+    """Бинарный STL определяется по размеру: 84 + 50 * число треугольников."""
+    count = _header_count(stl_file_path)
+    if count is None:
+        return False
+    return _source_size(stl_file_path) == BINARY_HEADER_SIZE + count * BINARY_STL_DTYPE.itemsize
+
+
+def _binary_chunks(stl_file_path, chunk_triangles=CHUNK_TRIANGLES, count=None):
+    """
+    Треугольники бинарного STL блоками (v0, v1, v2) без загрузки файла целиком:
+    файл отображается в память через np.memmap (буфер в памяти - через
+    np.frombuffer без копии), так что потребление памяти не зависит от размера меша.
+    count - число треугольников, по умолчанию - сколько помещается в файл.
+    """
+    if count is None:
+        count = (_source_size(stl_file_path) - BINARY_HEADER_SIZE) // BINARY_STL_DTYPE.itemsize
+    if count <= 0:
+        return
+
+    if _is_buffer(stl_file_path):
+        triangles = np.frombuffer(stl_file_path, dtype=BINARY_STL_DTYPE,
+                                  count=count, offset=BINARY_HEADER_SIZE)
+    else:
+        triangles = np.memmap(stl_file_path, dtype=BINARY_STL_DTYPE, mode='r',
+                              offset=BINARY_HEADER_SIZE, shape=(count,))
+    for start in range(0, count, chunk_triangles):
+        chunk = triangles[start:start + chunk_triangles]
+        yield chunk['v0'], chunk['v1'], chunk['v2']
+    del triangles
+
+
+# Размер блока при чтении ASCII STL; блок обрезается по последнему endfacet
+ASCII_CHUNK_BYTES = 32 << 20
+# Только строки, начинающиеся с vertex: слово в заголовке "solid vertex ..." не в счёт
+_VERTEX_RE = re.compile(rb'^[ \t]*vertex[ \t]+([^\r\n]+)', re.M)
+
+
+def is_ascii_stl(stl_file_path) -> bool:
+    # Бинарные STL тоже бывают с заголовком "solid ...", поэтому в начале
+    # файла ищем ещё и текстовый facet
+    head = _read_head(stl_file_path, 1024).lower()
+    return head.startswith(b'solid') and b'facet' in head and not is_binary_stl(stl_file_path)
+
+
+def _iter_blocks(stl_file_path, chunk_bytes):
+    if _is_buffer(stl_file_path):
+        view = memoryview(stl_file_path)
+        for start in range(0, len(view), chunk_bytes):
+            yield bytes(view[start:start + chunk_bytes])
+        return
+    with open(stl_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_bytes), b''):
+            yield block
+
+
+def _ascii_vertices(data: bytes):
+    """
+    Достаёт все вершины из куска ASCII STL одним проходом:
+    строки после 'vertex' склеиваются и разбираются numpy целиком.
+    Возвращает массив формы (n, 3, 3). Бросает ValueError, если в какой-то
+    строке не три числа: иначе все следующие треугольники молча съехали бы.
+    """
+    lines = _VERTEX_RE.findall(data)
+    if not lines:
+        return np.empty((0, 3, 3))
+    values = np.fromstring(b' '.join(lines).decode('ascii'), sep=' ')
+    if values.size != 3 * len(lines):
+        raise ValueError("ASCII STL: в строке vertex должно быть три координаты")
+    return values[:values.size - values.size % 9].reshape(-1, 3, 3)
+
+
+def _ascii_chunks(stl_file_path, chunk_bytes=ASCII_CHUNK_BYTES):
+    """
+    Треугольники ASCII STL блоками (v0, v1, v2). Файл читается кусками,
+    обрезанными по последнему endfacet, каждый разбирается векторно (_ascii_vertices).
+    """
+    tail = b''
+    blocks = _iter_blocks(stl_file_path, chunk_bytes)
+    while True:
+        block = next(blocks, b'')
+        data = tail + block
+        if block:
+            cut = data.rfind(b'endfacet')
+            if cut < 0:
+                tail = data
+                continue
+            data, tail = data[:cut], data[cut:]
+        vertices = _ascii_vertices(data)
+        if len(vertices):
+            yield vertices[:, 0], vertices[:, 1], vertices[:, 2]
+        if not block:
+            break
+
+
+def _triangle_chunks(stl_file_path):
+    """
+    Треугольники STL блоками (v0, v1, v2) с автоопределением формата.
+
+    Если файл не разобрался как ASCII (например, бинарный с заголовком
+    "solid ..."), а размер вмещает число треугольников из заголовка -
+    читаем его как бинарный с мусором в конце. Остальное отдаём numpy-stl,
+    который бросает ошибку на несогласованном файле: так деталь не получит
+    нулевой объём молча.
+    """
+    if is_binary_stl(stl_file_path):
+        yield from _binary_chunks(stl_file_path)
+        return
+    if is_ascii_stl(stl_file_path):
+        found = False
+        for chunk in _ascii_chunks(stl_file_path):
+            found = True
+            yield chunk
+        if found:
+            return
+
+    count = _header_count(stl_file_path)
+    if count and _source_size(stl_file_path) >= BINARY_HEADER_SIZE + count * BINARY_STL_DTYPE.itemsize:
+        yield from _binary_chunks(stl_file_path, count=count)
+        return
+
+    # Нестандартный файл - разбирает numpy-stl
+    if _is_buffer(stl_file_path):
+        your_mesh = mesh.Mesh.from_file('buffer.stl', fh=io.BytesIO(stl_file_path))
+    else:
+        your_mesh = mesh.Mesh.from_file(stl_file_path)
+    yield your_mesh.v0, your_mesh.v1, your_mesh.v2
+
+
+def _vertex_keys(corners):
+    """
+    Ключи uint64 вершин по битам координат float32: одинаковые вершины соседних
+    треугольников получают одинаковый ключ (-0.0 приводится к 0.0).
+    corners - массив (3 вершины, 3 координаты, n). x и y входят в ключ без
+    потерь, z подмешивается умножением, так что совпадение ключей у разных
+    вершин практически исключено. Возвращает массив (3, n).
+    """
+    bits = (corners.astype(np.float32) + np.float32(0)).view(np.uint32).astype(np.uint64)
+    return (bits[:, 0] << np.uint64(32) | bits[:, 1]) ^ (bits[:, 2] * np.uint64(0x9E3779B97F4A7C15))
+
+
+def count_shells(corner_keys) -> int:
+    """
+    Число несвязных оболочек меша: компоненты связности графа вершин,
+    где рёбра - стороны треугольников. corner_keys - ключи вершин (3, n)
+    из _vertex_keys. Union-find векторный: корни подвешиваются к меньшему
+    корню соседа, затем деревья сжимаются перескоком через родителя.
+    """
+    if not corner_keys.size:
+        return 0
+    _, inverse = np.unique(corner_keys.ravel(), return_inverse=True)
+    corners = inverse.reshape(3, -1)
+    a = np.concatenate((corners[0], corners[0]))
+    b = np.concatenate((corners[1], corners[2]))
+    parent = np.arange(int(inverse.max()) + 1)
+    while True:
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            break
+        # Рёбра внутри одной компоненты такими и останутся - отбрасываем
+        a, b, root_a, root_b = a[differ], b[differ], root_a[differ], root_b[differ]
+        parent[np.maximum(root_a, root_b)] = np.minimum(root_a, root_b)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return int(np.count_nonzero(parent == np.arange(len(parent))))
+
+
+class MeshGeometry:
+    """
+    Накопитель геометрии меша по блокам треугольников: объём, площадь
+    поверхности, габариты и (по желанию) число оболочек за один проход.
+
+    Блок один раз раскладывается в float64 по координатам (3 вершины x 3 оси x n),
+    дальше всё считается по непрерывным строкам: векторное произведение рёбер
+    n = (v1 - v0) x (v2 - v0) даёт сразу площадь |n| / 2 и знаковый объём
+    тетраэдра v0 · n / 6, а габариты - минимумы и максимумы тех же строк.
+    Это единственное ядро расчёта: объём без остальных свойств стоил бы почти столько же.
+    Для оболочек копятся ключи вершин (24 байта на треугольник), если меш
+    не больше SHELLS_MAX_TRIANGLES.
+    """
+
+    def __init__(self, shells: bool = True):
+        self.volume_mm3 = 0.0
+        self.area_mm2 = 0.0
+        self.triangles = 0
+        self.lower = np.full(3, np.inf)
+        self.upper = np.full(3, -np.inf)
+        self._keys = [] if shells else None
+
+    def add(self, v0, v1, v2) -> None:
+        if not len(v0):
+            return
+        corners = np.empty((3, 3, len(v0)))
+        corners[0], corners[1], corners[2] = v0.T, v1.T, v2.T
+        e1 = corners[1] - corners[0]
+        e2 = corners[2] - corners[0]
+        normals = np.empty_like(e1)
+        for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+            np.multiply(e1[j], e2[k], out=normals[i])
+            normals[i] -= e1[k] * e2[j]
+        self.volume_mm3 += float(np.einsum('ij,ij->', corners[0], normals)) / 6.0
+        self.area_mm2 += float(np.sqrt(np.einsum('ij,ij->j', normals, normals)).sum()) / 2.0
+        for axis in range(3):
+            self.lower[axis] = min(self.lower[axis], corners[:, axis].min())
+            self.upper[axis] = max(self.upper[axis], corners[:, axis].max())
+        self.triangles += len(v0)
+        if self._keys is not None:
+            if self.triangles > SHELLS_MAX_TRIANGLES:
+                self._keys = None
+            else:
+                self._keys.append(_vertex_keys(corners))
+
+    def result(self) -> dict:
+        """
+        Возвращает:
+            dict: {'volume_mm3' (по модулю), 'area_mm2', 'bbox_mm': [[x, y, z] мин., [x, y, z] макс.],
+                   'size_mm': [x, y, z], 'shells' (None, если не считались), 'triangles'}
+        """
+        if not self.triangles:
+            lower = upper = [0.0, 0.0, 0.0]
+        else:
+            lower, upper = self.lower.tolist(), self.upper.tolist()
+        shells = None
+        if self._keys is not None:
+            shells = count_shells(np.concatenate(self._keys, axis=1)) if self._keys else 0
+        return {
+            'volume_mm3': abs(self.volume_mm3),  # STL может быть с "вывернутыми" нормалями
+            'area_mm2': self.area_mm2,
+            'bbox_mm': [lower, upper],
+            'size_mm': [hi - lo for lo, hi in zip(lower, upper)],
+            'shells': shells,
+            'triangles': self.triangles,
+        }
+
+
+def stl_geometry(stl_file_path, shells: bool = True) -> dict:
+    """
+    Объём, площадь поверхности, габариты и число оболочек STL за один
+    проход по файлу (см. MeshGeometry), с автоопределением формата.
+    shells=False пропускает подсчёт оболочек - он единственный требует
+    памяти на все вершины и сортировки (см. SHELLS_MAX_TRIANGLES).
+    """
+    geometry = MeshGeometry(shells)
+    for v0, v1, v2 in _triangle_chunks(stl_file_path):
+        geometry.add(v0, v1, v2)
+    return geometry.result()
+
+
+def print_volume(geometry: dict, wall_mm: float = PRINT_WALL_MM, infill: float = PRINT_INFILL) -> float:
+    """
+    Оценка объёма пластика при печати, см³: оболочка толщиной wall_mm
+    (площадь поверхности x толщина, не больше объёма детали) сплошная,
+    остальное заполнено на долю infill. При infill=None деталь считается сплошной.
+    """
+    volume_mm3 = geometry['volume_mm3']
+    if infill is None:
+        return volume_mm3 / 1000.0
+    shell_mm3 = min(volume_mm3, geometry['area_mm2'] * wall_mm)
+    return (shell_mm3 + (volume_mm3 - shell_mm3) * infill) / 1000.0
+
+
+def fits_bed(geometry: dict, bed_mm=BED_SIZE_MM) -> bool:
+    """Помещается ли деталь в область печати bed_mm (x, y, z) с учётом поворота на любую грань."""
+    if not bed_mm:
+        return True
+    return all(size <= bed for size, bed in zip(sorted(geometry['size_mm']), sorted(bed_mm)))
+
+
+def calculate_volume_from_stl(stl_file_path):
+    """
+    Рассчитывает объём 3D-модели из STL-файла.
+
+    Параметры:
+        stl_file_path (str | bytes): Путь к STL-файлу или его содержимое.
+
+    Возвращает:
+        float: объём в см³
+    """
+    # Объём в мм³ (в единицах модели, обычно мм), тем же ядром, что и при загрузке в бота
+    volume_mm3 = stl_geometry(stl_file_path, shells=False)['volume_mm3']
+    return volume_mm3 / 1000.0  # 1 см³ = 1000 мм³
+
 
 def calculate_mass_from_stl(stl_file_path, material_density_g_cm3=1.26):
     """
     Рассчитывает массу 3D-модели из STL-файла.
 
     Параметры:
-        stl_file_path (str): Путь к STL-файлу.
+        stl_file_path (str | bytes): Путь к STL-файлу или его содержимое.
         material_density_g_cm3 (float): Плотность материала в г/см³.
                                         PLA ≈ 1.24, ABS ≈ 1.04, PETG ≈ 1.27
 
     Возвращает:
-        dict: {'volume_cm3': float, 'mass_g': float}
+        float: масса в граммах
     """
-    # Загружаем модель
-    your_mesh = mesh.Mesh.from_file(stl_file_path)
+    volume_cm3 = calculate_volume_from_stl(stl_file_path)
 
-    # Вычисляем объём в мм³ (библиотека возвращает в единицах модели, обычно мм)
-    volume_mm3 = your_mesh.get_mass_properties()[0]  # volume in mm³
+    mass_g = volume_cm3 * material_density_g_cm3
 
-    if volume_mm3 < 0:
-        volume_mm3 = -volume_mm3  # STL может быть с "вывернутыми" нормалями
+    return mass_g
 
-    volume_cm3 = volume_mm3 / 1000.0  # 1 см³ = 1000 мм³
 
-    mass_g = volume_cm3 * material_density_g_cm3
+def calculate_print_volume_cached(stl_file_path, cache=None):
+    """Объём пластика при печати в см³ (print_volume) через постоянный кэш."""
+    return mass_job(stl_file_path, 1.0, cache)['print_volume_cm3']
 
-    return mass_g
+
+def mass_job(stl_file_path, material_density_g_cm3=1.26, cache=None, file_hash=None):
+    """
+    Расчёт массы через кэш со статистикой - для запуска в пуле процессов.
+    Геометрия меша (stl_geometry) считается одним проходом и кэшируется
+    по хэшу содержимого, масса в любом материале получается из неё.
+    Оболочки считаются только при COUNT_SHELLS.
+    file_hash - уже посчитанный хэш содержимого (см. stl_store), чтобы не читать файл дважды.
+
+    Возвращает:
+        dict: {'mass_g', 'volume_cm3', 'print_volume_cm3', 'geometry', 'fits_bed', 'cached',
+               'hash', 'bytes', 'triangles', 'timings': {'stl_hash': с, 'stl_volume': с}}
+    """
+    if cache is None:
+        cache = stl_cache.get_cache()
+
+    start = time.perf_counter()
+    if file_hash is None:
+        file_hash = stl_cache.content_hash(stl_file_path)
+    geometry = cache.get_geometry(file_hash)
+    if geometry is not None and COUNT_SHELLS and geometry['shells'] is None \
+            and geometry['triangles'] <= SHELLS_MAX_TRIANGLES:
+        geometry = None  # Посчитано до включения COUNT_SHELLS
+    hashed = time.perf_counter()
+    result = {
+        'bytes': _source_size(stl_file_path),
+        'triangles': 0,
+        'cached': geometry is not None,
+        'hash': file_hash,
+        'timings': {'stl_hash': hashed - start},
+    }
+    if geometry is None:
+        geometry = stl_geometry(stl_file_path, shells=COUNT_SHELLS)
+        result['triangles'] = geometry['triangles']
+        result['timings']['stl_volume'] = time.perf_counter() - hashed
+        cache.put_geometry(file_hash, geometry)
+
+    volume_cm3 = geometry['volume_mm3'] / 1000.0
+    result['geometry'] = geometry
+    result['volume_cm3'] = volume_cm3
+    result['print_volume_cm3'] = print_volume(geometry)
+    result['fits_bed'] = fits_bed(geometry)
+    result['mass_g'] = volume_cm3 * material_density_g_cm3
+    return result
 
 
 # # Пример использования:
@@ -0,0 +1,48 @@
+import io
+import os
+import shutil
+import tempfile
+
+
+# Файлы больше порога скачиваются во временную папку заказа, а не в память
+SPILL_THRESHOLD = 32 * 1024 * 1024
+
+
+class OrderWorkspace:
+    """
+    Рабочее пространство одного заказа: STL скачиваются в память (или во
+    временную папку заказа, если файл большой) и отдаются расчёту массы
+    без повторного чтения с общего диска. Разные заказы с одинаковыми
+    именами файлов друг другу не мешают.
+    """
+
+    def __init__(self, order_id: str, spill_threshold: int = SPILL_THRESHOLD):
+        self.order_id = order_id
+        self.spill_threshold = spill_threshold
+        self._tmp_dir = None
+
+    def destination(self, file_name: str, file_size: int):
+        """
+        Куда качать файл: BytesIO для небольших файлов,
+        путь во временной папке заказа - для больших.
+        """
+        if file_size is None or file_size <= self.spill_threshold:
+            return io.BytesIO()
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix=f"order_{self.order_id}_")
+        return os.path.join(self._tmp_dir, os.path.basename(file_name))
+
+    @staticmethod
+    def source(destination):
+        """
+        Превращает место скачивания в то, что можно передать
+        в weight_from_stl: bytes или путь.
+        """
+        if isinstance(destination, io.BytesIO):
+            return destination.getvalue()
+        return destination
+
+    def cleanup(self) -> None:
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None